@@ -1,7 +1,7 @@
 # hamchat/core/session.py
 from __future__ import annotations
 import json
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from typing import Optional
 from PyQt6.QtCore import QObject, pyqtSignal
 from pathlib import Path
@@ -23,7 +23,7 @@ class SessionData:
     role: str = "guest"                  # "guest" | "user" | "admin"
     runtime_mode: str = "solo"           # "solo" | "snout" | "ham"
     server_url: Optional[str] = None
-    prefs: Preferences = Preferences()
+    prefs: Preferences = field(default_factory=Preferences)
     current_model: str = None
     vision: bool = False
     profile_id: Optional[int] = None
@@ -132,6 +132,16 @@ class SessionManager(QObject):
         self.sessionChanged.emit(self.current)
         self.prefsChanged.emit(self.current.prefs)
 
+    # pref getters (bound methods, so callbacks like the menus skip a lambda frame)
+    def get_theme_variant(self) -> str:
+        return self.current.prefs.theme_variant
+
+    def get_spell_enabled(self) -> bool:
+        return self.current.prefs.spellcheck_enabled
+
+    def get_locale(self) -> str:
+        return self.current.prefs.locale
+
     # unified mutators (persist + signal)
     def set_theme_variant(self, variant: str):
         self.current.prefs.theme_variant = variant
@@ -42,8 +42,15 @@ def _data_dir() -> Path:
 
 
 def _apply_runtime_pragmas(conn) -> None:
+    # Per-connection settings only; journal_mode=WAL is persisted in the file at creation.
+    # None of these read the database, so they are safe to run before an SQLCipher key.
     cur = conn.cursor()
     cur.execute("PRAGMA foreign_keys=ON;")
+    cur.execute("PRAGMA synchronous=NORMAL;")
+    cur.execute("PRAGMA busy_timeout=5000;")
+    # db_init sets these only on the creating connection; they don't persist in the file.
+    cur.execute("PRAGMA temp_store=MEMORY;")
+    cur.execute("PRAGMA cache_size=-20000;")  # ~20 MB page cache per connection
 
 
 def init_and_open() -> Tuple[sqlite3.Connection, str]:
@@ -57,16 +64,33 @@ def init_and_open() -> Tuple[sqlite3.Connection, str]:
     if rc != 0:
         raise RuntimeError("Database could not be initialized/verified.")
 
-    db_path = data_dir / DB_FILENAME
+    return _connect_detected(data_dir / DB_FILENAME, verify=True)
 
+
+def open_connection(*, check_same_thread: bool = True):
+    """
+    Open an additional connection to the already-initialised database (no init / integrity
+    pass). Used for background writers; pass check_same_thread=False when the connection is
+    created on one thread and then used exclusively by another.
+    """
+    conn, _mode = _connect_detected(_data_dir() / DB_FILENAME, verify=False,
+                                    check_same_thread=check_same_thread)
+    return conn
+
+
+def _connect_detected(db_path: Path, *, verify: bool, check_same_thread: bool = True):
     # 1) try plain sqlite
     try:
-        conn = sqlite3.connect(db_path)
+        conn = sqlite3.connect(db_path, check_same_thread=check_same_thread)
         _apply_runtime_pragmas(conn)
         cur = conn.cursor()
-        cur.execute("PRAGMA integrity_check;")
-        if cur.fetchone()[0] == "ok":
-            # sanity check: meta should exist
+        if verify:
+            cur.execute("PRAGMA integrity_check;")
+            ok = cur.fetchone()[0] == "ok"
+        else:
+            ok = True
+        if ok:
+            # sanity check: meta should exist (raises on an encrypted file)
             cur.execute("SELECT value FROM meta WHERE key='db_mode';")
             row = cur.fetchone()
             mode = row[0] if row else "open"
@@ -84,7 +108,7 @@ def init_and_open() -> Tuple[sqlite3.Connection, str]:
     if not key:
         raise RuntimeError("Encrypted DB but no key available in keyring/ENV.")
 
-    conn = sqlcipher.connect(str(db_path))  # type: ignore
+    conn = sqlcipher.connect(str(db_path), check_same_thread=check_same_thread)  # type: ignore
     _apply_runtime_pragmas(conn)
     cur = conn.cursor()
     # mirror your PRAGMA setup
@@ -378,36 +402,93 @@ def rename_conversation(conn, conversation_id: int, title: str) -> None:
 
 def add_message(conn, conversation_id: int, sender_type: SenderType,
                 sender_id: Optional[int], content: str,
-                metadata: Optional[Dict[str, Any]] = None) -> int:
+                metadata: Optional[Dict[str, Any]] = None, *, commit: bool = True) -> int:
     """
     Insert a message row and link any attachment files via message_files.
     Returns the new messages.id.
+    Pass commit=False to leave the transaction open so several writes can share one commit.
     """
-    meta_json = json.dumps(metadata or {})
-    mode = read_db_mode(conn)
     cur = conn.cursor()
+    mid, links = _insert_message(conn, cur, read_db_mode(conn), conversation_id,
+                                 sender_type, sender_id, content, metadata)
+    if links:
+        cur.executemany(_SQL_LINK_FILE, links)
+
+    if commit:
+        conn.commit()
+    return mid
+
+
+def clone_messages_bulk(conn, src_conv_id: int, dst_conv_id: int, upto_id: int,
+                        include_pivot: bool = False) -> int:
+    """
+    Copy the messages of src_conv_id with id < upto_id (<= when include_pivot) into
+    dst_conv_id, oldest first, plus their message_files links. Everything stays in SQL:
+    no content is decrypted/re-encrypted and the whole copy is one transaction.
+    Returns the number of messages copied; on error nothing is copied and the exception re-raised.
+    """
+    op = "<=" if include_pivot else "<"
+    src_where = f"WHERE conversation_id = ? AND id {op} ? ORDER BY id"
+    src_args = (int(src_conv_id), int(upto_id))
+    with conn:
+        cur = conn.cursor()
+        cur.execute("SELECT COALESCE(MAX(id), 0) FROM messages WHERE conversation_id = ?",
+                    (int(dst_conv_id),))
+        floor = int(cur.fetchone()[0])
+        cur.execute(
+            "INSERT INTO messages(conversation_id, sender_type, sender_id, content, content_ct, "
+            "content_nonce, content_key_id, metadata, created) "
+            "SELECT ?, sender_type, sender_id, content, content_ct, content_nonce, content_key_id, "
+            "metadata, ? FROM messages " + src_where,
+            (int(dst_conv_id), _now()) + src_args,
+        )
+        n = cur.rowcount
+        # AUTOINCREMENT ids are handed out in insert order, so old and new ids pair up by rank.
+        cur.execute("SELECT id FROM messages " + src_where, src_args)
+        old_ids = [r[0] for r in cur.fetchall()]
+        cur.execute("SELECT id FROM messages WHERE conversation_id = ? AND id > ? ORDER BY id",
+                    (int(dst_conv_id), floor))
+        new_ids = [r[0] for r in cur.fetchall()]
+        cur.executemany(
+            "INSERT OR IGNORE INTO message_files(message_id, file_id, role) "
+            "SELECT ?, file_id, role FROM message_files WHERE message_id = ?",
+            zip(new_ids, old_ids),
+        )
+    return n
+
+
+_SQL_INSERT_MESSAGE = (
+    "INSERT INTO messages(conversation_id, sender_type, sender_id, content, content_ct, content_nonce, content_key_id, metadata, created) "
+    "VALUES(?,?,?,?,?,?,?,?,?)"
+)
+_SQL_LINK_FILE = "INSERT OR IGNORE INTO message_files(message_id, file_id, role) VALUES(?,?,?)"
+
+
+def _insert_message(conn, cur, mode: str, conversation_id: int, sender_type: str,
+                    sender_id: Optional[int], content: str,
+                    metadata: Optional[Dict[str, Any]]) -> Tuple[int, List[Tuple[int, int, str]]]:
+    """Insert one messages row; returns (id, message_files rows still to be inserted)."""
+    meta_json = json.dumps(metadata or {})
 
     # 1) Insert message row (encrypted or plaintext depending on mode)
     if mode == "strict":
         ct, nonce = encrypt_field(conn, content)
         cur.execute(
-            "INSERT INTO messages(conversation_id, sender_type, sender_id, content, content_ct, content_nonce, content_key_id, metadata, created) "
-            "VALUES(?,?,?,?,?,?,?,?,?)",
+            _SQL_INSERT_MESSAGE,
             (conversation_id, sender_type, sender_id, None, ct, nonce, 1, meta_json, _now()),
         )
     else:
         cur.execute(
-            "INSERT INTO messages(conversation_id, sender_type, sender_id, content, content_ct, content_nonce, content_key_id, metadata, created) "
-            "VALUES(?,?,?,?,?,?,?,?,?)",
+            _SQL_INSERT_MESSAGE,
             (conversation_id, sender_type, sender_id, content, None, None, None, meta_json, _now()),
         )
 
     mid = int(cur.lastrowid)
 
-    # 2) Link attachments to files via message_files (triggers update ref_count)
+    # 2) Collect attachment links for message_files (triggers update ref_count)
+    rows_to_insert: List[Tuple[int, int, str]] = []
     if metadata and isinstance(metadata, dict):
         attachments = metadata.get("attachments") or []
-        rows_to_insert = []
         for att in attachments:
             if not isinstance(att, dict):
                 continue
@@ -423,15 +504,7 @@ def add_message(conn, conversation_id: int, sender_type: SenderType,
                     rows_to_insert.append((mid, int(thumb_fid), "thumb"))
                 except (TypeError, ValueError):
                     pass
-
-        if rows_to_insert:
-            cur.executemany(
-                "INSERT OR IGNORE INTO message_files(message_id, file_id, role) VALUES(?,?,?)",
-                rows_to_insert,
-            )
-
-    conn.commit()
-    return mid
+    return mid, rows_to_insert
 
 
 
@@ -459,20 +532,21 @@ def delete_message(conn, message_id: int) -> None:
     conn.commit()
 
 
-def delete_many_messages(conn, conversation_id: int, message_id: int):
+def delete_many_messages(conn, conversation_id: int, message_id: int, *, commit: bool = True):
     """
-    Removes all messages in the conversation with id > message_id.
+    Removes all messages in the conversation with id >= message_id, in one statement
+    (message_files triggers still maintain ref_counts row by row).
+    Pass commit=False to leave the transaction open so several writes can share one commit.
     """
     if not conversation_id:
         return
     cur = conn.cursor()
     cur.execute(
-        "SELECT id FROM messages WHERE conversation_id = ? AND id >= ? ORDER BY id ASC",
+        "DELETE FROM messages WHERE conversation_id = ? AND id >= ?",
         (int(conversation_id), int(message_id)),
     )
-    rows = cur.fetchall()
-    for row in rows:
-        delete_message(conn, int(row[0]))
+    if commit:
+        conn.commit()
 
     try:
         orphan_sweep(cas_sweep=True)
@@ -489,6 +563,17 @@ def orphan_sweep(cas_sweep: bool = False, mem_sweep: bool = False):
     return summary
 
 
+def get_conversation_title(conn, conversation_id: int, user_id: int) -> Optional[str]:
+    """Title of one of the user's saved conversations (None if it isn't theirs / doesn't exist)."""
+    cur = conn.cursor()
+    cur.execute(
+        "SELECT title FROM saved_conversations WHERE id=? AND user_id=?",
+        (int(conversation_id), int(user_id)),
+    )
+    row = cur.fetchone()
+    return None if row is None else (row[0] or "")
+
+
 def list_conversations(conn, user_id: int, limit: int = 50) -> List[Dict[str, Any]]:
     cur = conn.cursor()
     cur.execute(
@@ -499,15 +584,61 @@ def list_conversations(conn, user_id: int, limit: int = 50) -> List[Dict[str, An
     return [{"id": r[0], "title": r[1], "created": r[2]} for r in rows]
 
 
+_SQL_MESSAGE_COLS = "SELECT id, sender_type, sender_id, content, content_ct, content_nonce, metadata, created FROM messages "
+
+
 def list_messages(conn, conversation_id: int, limit: int = 200) -> List[Dict[str, Any]]:
     mode = read_db_mode(conn)
     cur = conn.cursor()
     cur.execute(
-        "SELECT id, sender_type, sender_id, content, content_ct, content_nonce, metadata, created "
-        "FROM messages WHERE conversation_id=? ORDER BY id ASC LIMIT ?",
+        _SQL_MESSAGE_COLS + "WHERE conversation_id=? ORDER BY id ASC LIMIT ?",
         (conversation_id, limit),
     )
+    return _decode_message_rows(conn, mode, cur.fetchall())
+
+
+def list_messages_up_to(conn, conversation_id: int, pivot_id: int,
+                        include_pivot: bool = False) -> List[Dict[str, Any]]:
+    """
+    Messages of a conversation with id < pivot_id (<= when include_pivot), oldest first.
+    The bound is applied in SQL so rows past the pivot are never fetched or decrypted.
+    """
+    mode = read_db_mode(conn)
+    cur = conn.cursor()
+    op = "<=" if include_pivot else "<"
+    cur.execute(
+        _SQL_MESSAGE_COLS + f"WHERE conversation_id=? AND id {op} ? ORDER BY id ASC",
+        (conversation_id, int(pivot_id)),
+    )
+    return _decode_message_rows(conn, mode, cur.fetchall())
+
+
+def load_conversation_bundle(conn, conversation_id: int, limit: int = 200) -> Optional[Dict[str, Any]]:
+    """
+    One query for opening a chat: {"title", "created", "messages"} where messages is what
+    list_messages(conn, conversation_id, limit) returns. None if the conversation doesn't exist.
+    """
+    mode = read_db_mode(conn)
+    cur = conn.cursor()
+    cur.execute(
+        "SELECT c.title, c.created, m.id, m.sender_type, m.sender_id, m.content, m.content_ct, "
+        "m.content_nonce, m.metadata, m.created "
+        "FROM saved_conversations c LEFT JOIN messages m ON m.conversation_id = c.id "
+        "WHERE c.id=? ORDER BY m.id ASC LIMIT ?",
+        (int(conversation_id), limit),
+    )
     rows = cur.fetchall()
+    if not rows:
+        return None
+    return {
+        "title": rows[0][0],
+        "created": rows[0][1],
+        # a conversation without messages comes back as one row of NULL message columns
+        "messages": _decode_message_rows(conn, mode, [r[2:] for r in rows if r[2] is not None]),
+    }
+
+
+def _decode_message_rows(conn, mode: str, rows) -> List[Dict[str, Any]]:
     out = []
     for r in rows:
         content = r[3]
@@ -781,7 +912,37 @@ def cas_path_for_file(db, file_id: int) -> Optional[Path]:
     row = cur.fetchone()
     if not row:
         return None
-    sha_blob = row[0]
+    return _cas_readable_path(row[0], read_db_mode(db))
+
+
+# SQLite's default host-parameter limit is 999; stay well under it per IN (...) query.
+_IN_CHUNK = 500
+
+
+def cas_paths_for_files(db, file_ids: Iterable[int]) -> Dict[int, Path]:
+    """
+    Batch form of cas_path_for_file(): resolve many files.id values with one
+    query per chunk of ids. Ids that are unknown or missing on disk are left out.
+    """
+    ids = list(dict.fromkeys(int(i) for i in file_ids))
+    if not ids:
+        return {}
+    mode = read_db_mode(db)
+    out: Dict[int, Path] = {}
+    cur = db.cursor()
+    for start in range(0, len(ids), _IN_CHUNK):
+        chunk = ids[start:start + _IN_CHUNK]
+        marks = ",".join("?" * len(chunk))
+        cur.execute(f"SELECT id, sha256 FROM files WHERE id IN ({marks})", chunk)
+        for fid, sha_blob in cur.fetchall():
+            path = _cas_readable_path(sha_blob, mode)
+            if path is not None:
+                out[int(fid)] = path
+    return out
+
+
+def _cas_readable_path(sha_blob, mode: str) -> Optional[Path]:
+    """CAS path for a sha256 blob; in strict mode, a decrypted copy under cas_tmp/."""
     if isinstance(sha_blob, memoryview):
         sha_blob = sha_blob.tobytes()
     sha_hex = sha_blob.hex()
@@ -790,7 +951,6 @@ def cas_path_for_file(db, file_id: int) -> Optional[Path]:
     if not path.exists():
         return None
 
-    mode = read_db_mode(db)
     if mode != "strict":
         return path
 
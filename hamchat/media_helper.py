@@ -1,13 +1,32 @@
 # hamchat/media_helper.py
 from __future__ import annotations
 from dataclasses import dataclass
+from functools import lru_cache
 from typing import List, Tuple
 import hashlib, base64, imghdr, os, tempfile, shutil
-from PIL import Image  # Pillow
 
 THUMB_SIZE = 96  # square
 AVATAR_SIZE = 64  # default logical avatar size for profiles (square)
 
+# Avatar cleanup queries (kept as constants so the driver's statement cache can reuse them)
+_SQL_FILE_BY_SHA = "SELECT id FROM files WHERE sha256 = ?"
+_SQL_REFCOUNT = (
+    "SELECT (SELECT COUNT(1) FROM message_files WHERE file_id = ?1), "
+    "(SELECT COUNT(1) FROM ai_profiles WHERE avatar LIKE ?2)"
+)
+_SQL_DELETE_FILE = "DELETE FROM files WHERE id = ?"
+# Refcount check + delete in one atomic statement (RETURNING needs SQLite 3.35+)
+_SQL_DELETE_IF_UNREFERENCED = (
+    "DELETE FROM files WHERE sha256 = ?1 "
+    "AND NOT EXISTS (SELECT 1 FROM message_files WHERE file_id = files.id) "
+    "AND NOT EXISTS (SELECT 1 FROM ai_profiles WHERE avatar LIKE ?2) "
+    "RETURNING id"
+)
+
+def _local_path(p: str) -> str:
+    """Strip a leading file:// (any case) from drag-drop style paths."""
+    return p[7:] if p[:7].lower() == "file://" else p
+
 def _sha256_file(p: str) -> str:
     h = hashlib.sha256()
     with open(p, "rb") as f:
@@ -19,7 +38,27 @@ def _mime_guess(p: str) -> str:
     kind = imghdr.what(p) or ""
     return {"png":"image/png","jpeg":"image/jpeg","gif":"image/gif","bmp":"image/bmp","tiff":"image/tiff"}.get(kind, "application/octet-stream")
 
+@lru_cache(maxsize=1)
+def _pyvips():
+    """pyvips if it (and libvips) can be loaded, else None; probed once."""
+    try:
+        import pyvips
+        return pyvips
+    except Exception:  # ImportError, or OSError when the libvips shared library is missing
+        return None
+
 def _make_thumb(src: str, dst: str, size: int = THUMB_SIZE) -> Tuple[int,int]:
+    vips = _pyvips()
+    if vips is not None:
+        # Optional fast path: shrink-on-load never decodes the full-resolution image
+        im = vips.Image.thumbnail(src, size, height=size).colourspace("srgb")
+        if not im.hasalpha():
+            im = im.bandjoin(255)
+        # letterbox into square (transparent borders), same output as the Pillow path
+        im.gravity("centre", size, size, extend="background", background=[0, 0, 0, 0]).write_to_file(dst)
+        return size, size
+    # Pillow is only needed once media is attached; keep it off the startup import path.
+    from PIL import Image
     im = Image.open(src).convert("RGBA")
     # letterbox into square
     w, h = im.size
@@ -35,11 +74,27 @@ def _to_base64(p: str) -> str:
     with open(p, "rb") as f:
         return base64.b64encode(f.read()).decode("ascii")
 
-def process_images(paths: List[str], *, ephemeral: bool, db=None, session=None):
+def encode_llm_parts(parts: List[dict]) -> List[dict]:
+    """
+    Fill in data_base64 for image parts that only carry a "path" (see process_images(encode=False)).
+    Meant to run on the worker thread that sends the request; encoded parts pass through as-is.
+    """
+    out = []
+    for p in parts:
+        if isinstance(p, dict) and p.get("path") and not p.get("data_base64"):
+            src = p["path"]
+            p = {k: v for k, v in p.items() if k != "path"}
+            p["data_base64"] = _to_base64(src)
+        out.append(p)
+    return out
+
+def process_images(paths: List[str], *, ephemeral: bool, db=None, session=None, encode: bool = True):
     """
     Returns dict: {stored:[...], thumbs:[...], llm_parts:[...]}
     - guest/admin → copy into temp dir
     - user → CAS: insert-or-ignore by sha256; return file_id (requires db_ops)
+    - encode=False leaves llm_parts holding {"path": src} instead of base64, so the (large)
+      encode can happen off the GUI thread via encode_llm_parts()
     """
     results = {"stored": [], "thumbs": [], "llm_parts": []}
     if not ephemeral and db is None:
@@ -48,7 +103,7 @@ def process_images(paths: List[str], *, ephemeral: bool, db=None, session=None):
     work_dir = tempfile.mkdtemp(prefix="hamchat_")
 
     for idx, p in enumerate(paths):
-        src = p[7:] if p.lower().startswith("file://") else p
+        src = _local_path(p)
         sha = _sha256_file(src)
         mime = _mime_guess(src)
 
@@ -77,10 +132,13 @@ def process_images(paths: List[str], *, ephemeral: bool, db=None, session=None):
             thumb_file_id = None
 
         # llm part (base64 from the stored copy if ephemeral; else from src or cas fetch)
-        b64 = _to_base64(src)  # CAS fetch raw if you prefer
         results["stored"].append({"file_id": file_id, "tmp_path": stored_path, "sha256": sha, "mime": mime})
         results["thumbs"].append({"path": thumb_path, "w": THUMB_SIZE, "h": THUMB_SIZE, "file_id": thumb_file_id, "sha256": thumb_sha, "mime": thumb_mime})
-        results["llm_parts"].append({"type": "image", "media_type": mime, "data_base64": b64})
+        if encode:
+            b64 = _to_base64(src)  # CAS fetch raw if you prefer
+            results["llm_parts"].append({"type": "image", "media_type": mime, "data_base64": b64})
+        else:
+            results["llm_parts"].append({"type": "image", "media_type": mime, "path": src})
     return results
 
 def store_profile_avatar(src: str, *, db, size: int = AVATAR_SIZE) -> str:
@@ -97,7 +155,7 @@ def store_profile_avatar(src: str, *, db, size: int = AVATAR_SIZE) -> str:
         return src
 
     # Normalise source path (strip file:// for drag-drop style paths).
-    src_path = src[7:] if src.lower().startswith("file://") else src
+    src_path = _local_path(src)
     if not os.path.exists(src_path):
         return src
 
@@ -127,6 +185,15 @@ def store_profile_avatar(src: str, *, db, size: int = AVATAR_SIZE) -> str:
         except Exception:
             pass
 
+def _unlink_cas_variants(base_dir: str, sha_hex: str) -> None:
+    """Remove <base_dir>/cas/<sha> and <base_dir>/cas_tmp/<sha>; missing files are fine."""
+    for sub in ("cas", "cas_tmp"):
+        try:
+            os.unlink(os.path.join(base_dir, sub, sha_hex))
+        except OSError:
+            # Best-effort only (includes FileNotFoundError)
+            pass
+
 def cleanup_profile_avatar(db, old_avatar_path: str) -> None:
     """
     Best-effort cleanup for a *previous* avatar image that was stored in CAS.
@@ -151,61 +218,53 @@ def cleanup_profile_avatar(db, old_avatar_path: str) -> None:
             sha_bytes = bytes.fromhex(sha_hex)
         except ValueError:
             return
+        base_dir = os.path.dirname(os.path.dirname(old_avatar_path))
+        # Profiles are matched on the SHA suffix to catch both cas/ and cas_tmp/ variants.
+        avatar_like = f"%{sha_hex}"
 
         cur = db.cursor()
         try:
-            # Find the CAS metadata row
-            cur.execute("SELECT id FROM files WHERE sha256 = ?", (sha_bytes,))
+            try:
+                with db:
+                    cur.execute(_SQL_DELETE_IF_UNREFERENCED, (sha_bytes, avatar_like))
+                    deleted = cur.fetchall()
+            except Exception:
+                deleted = None  # RETURNING not supported by this SQLite/SQLCipher build
+
+            if deleted is not None:
+                if deleted:
+                    _unlink_cas_variants(base_dir, sha_hex)
+                    return
+                # Nothing deleted: either still referenced, or there is no files row at all.
+                cur.execute(_SQL_FILE_BY_SHA, (sha_bytes,))
+                if not cur.fetchone():
+                    _unlink_cas_variants(base_dir, sha_hex)
+                return
+
+            # Fallback for older SQLite: find the CAS metadata row
+            cur.execute(_SQL_FILE_BY_SHA, (sha_bytes,))
             row = cur.fetchone()
             if not row:
                 # No DB row; at most try to delete the on-disk file and bail.
-                base_dir = os.path.dirname(os.path.dirname(old_avatar_path))
-                cas_dirs = [
-                    os.path.join(base_dir, "cas"),
-                    os.path.join(base_dir, "cas_tmp"),
-                ]
-                for d in cas_dirs:
-                    candidate = os.path.join(d, sha_hex)
-                    try:
-                        if os.path.exists(candidate):
-                            os.remove(candidate)
-                    except Exception:
-                        pass
+                _unlink_cas_variants(base_dir, sha_hex)
                 return
 
             file_id = int(row[0])
 
-            # 1) Is any message still referencing this file?
-            cur.execute("SELECT COUNT(*) FROM message_files WHERE file_id = ?", (file_id,))
-            msg_count = cur.fetchone()[0] or 0
+            # Is any message or profile still referencing this file? One round-trip for both.
+            cur.execute(_SQL_REFCOUNT, (file_id, avatar_like))
+            msg_count, prof_count = cur.fetchone()
 
-            # 2) Is any profile still using this avatar path (other than the one we just updated)?
-            # We match on the SHA suffix to catch both cas/ and cas_tmp/ variants.
-            cur.execute("SELECT COUNT(*) FROM ai_profiles WHERE avatar LIKE ?", (f"%{sha_hex}",))
-            prof_count = cur.fetchone()[0] or 0
-
-            if msg_count > 0 or prof_count > 0:
+            if (msg_count or 0) > 0 or (prof_count or 0) > 0:
                 # Still in use somewhere → do not delete.
                 return
 
             # At this point, no messages and no profiles reference this SHA.
-            base_dir = os.path.dirname(os.path.dirname(old_avatar_path))
-            cas_dirs = [
-                os.path.join(base_dir, "cas"),
-                os.path.join(base_dir, "cas_tmp"),
-            ]
-            for d in cas_dirs:
-                candidate = os.path.join(d, sha_hex)
-                try:
-                    if os.path.exists(candidate):
-                        os.remove(candidate)
-                except Exception:
-                    # Best-effort only
-                    pass
-
-            # Remove metadata row
-            cur.execute("DELETE FROM files WHERE id = ?", (file_id,))
-            db.commit()
+            _unlink_cas_variants(base_dir, sha_hex)
+
+            # Remove metadata row; the connection context manager commits (or rolls back) atomically
+            with db:
+                cur.execute(_SQL_DELETE_FILE, (file_id,))
         finally:
             cur.close()
     except Exception:
@@ -1,6 +1,7 @@
 # hamchat/paths.py
 from __future__ import annotations
 import os
+from functools import lru_cache
 from pathlib import Path
 from typing import Tuple
 from .constants import APP_NAME
@@ -8,16 +9,23 @@ from .constants import APP_NAME
 def default_data_dir() -> Path:
     # Keep it simple & portable: local "data" folder by default.
     # Can be overridden via env HAMCHAT_DATA_DIR.
-    env = os.getenv("HAMCHAT_DATA_DIR")
+    return _resolve_data_dir(os.getenv("HAMCHAT_DATA_DIR"))
+
+@lru_cache(maxsize=8)
+def _resolve_data_dir(env: str | None) -> Path:
+    # Keyed on the env value, so changing HAMCHAT_DATA_DIR at runtime still takes effect.
     if env:
         return Path(env).expanduser().resolve()
     return Path("data").resolve()
 
+@lru_cache(maxsize=8)
 def log_paths(data_dir: Path) -> Tuple[Path, Path]:
+    # mkdir only needs to happen once per process and data dir.
     logs_dir = data_dir / "logs"
     logs_dir.mkdir(parents=True, exist_ok=True)
     return logs_dir, logs_dir / "app.log"
 
+@lru_cache(maxsize=8)
 def settings_dir(project_root: Path | None = None) -> Path:
     # Non-sensitive JSON settings live here.
     base = Path(project_root) if project_root else Path(".")
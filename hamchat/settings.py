@@ -1,6 +1,6 @@
 # hamchat/settings.py
 from __future__ import annotations
-import json
+import copy, json, os
 from pathlib import Path
 from typing import Any, Dict
 from .constants import DEFAULT_LOG_MAX_BYTES, DEFAULT_LOG_BACKUP_COUNT
@@ -19,29 +19,62 @@ DEFAULT_SETTINGS: Dict[str, Any] = {
     }
 }
 
+# Serialized once; every caller gets its own fresh parse, so nested dicts are never shared
+_DEFAULTS_JSON = json.dumps(DEFAULT_SETTINGS)
+
+def _fresh_defaults() -> dict:
+    return json.loads(_DEFAULTS_JSON)
+
+def _merge_defaults(cfg: dict, defaults: dict) -> None:
+    # Simple forward-fill of missing keys (iterative; the tree is shallow)
+    stack = [(cfg, defaults)]
+    while stack:
+        a, b = stack.pop()
+        for k, v in b.items():
+            if k not in a:
+                a[k] = v
+            elif isinstance(v, dict) and isinstance(a[k], dict):
+                stack.append((a[k], v))
+
+# Parsed + merged settings keyed by path; invalidated by (mtime_ns, size) changes
+_CACHE: Dict[str, tuple[tuple[int, int], dict]] = {}
+
 def load_settings(path: Path) -> dict:
     if not path.exists():
         save_settings(path, DEFAULT_SETTINGS)
-        return DEFAULT_SETTINGS.copy()
+        return _fresh_defaults()
+    st = path.stat()
+    stamp = (st.st_mtime_ns, st.st_size)
+    cached = _CACHE.get(str(path))
+    if cached and cached[0] == stamp:
+        return copy.deepcopy(cached[1])
     with path.open("r", encoding="utf-8") as f:
         cfg = json.load(f)
-    # Simple forward-fill of missing keys
-    def merge(a: dict, b: dict):
-        for k, v in b.items():
-            if k not in a:
-                a[k] = v
-            elif isinstance(v, dict) and isinstance(a.get(k), dict):
-                merge(a[k], v)
     merged = dict(cfg)
-    merge(merged, DEFAULT_SETTINGS)
+    _merge_defaults(merged, _fresh_defaults())
+    _CACHE[str(path)] = (stamp, copy.deepcopy(merged))
     return merged
 
+def _dumps(data: dict) -> bytes:
+    # Same bytes json.dump(indent=2, sort_keys=True) has always written, so the skip check holds
+    return json.dumps(data, indent=2, sort_keys=True).encode("utf-8")
+
 def save_settings(path: Path, data: dict) -> None:
+    raw = _dumps(data)
+    try:
+        if path.read_bytes() == raw:
+            return  # nothing changed; don't touch the disk
+    except OSError:
+        pass
     path.parent.mkdir(parents=True, exist_ok=True)
-    tmp = path.with_suffix(".tmp")
-    with tmp.open("w", encoding="utf-8") as f:
-        json.dump(data, f, indent=2, sort_keys=True)
-    tmp.replace(path)
+    # Per-file temp name so sibling settings (app.json / app.yaml ...) never share one
+    tmp = path.with_name(path.name + ".tmp")
+    with tmp.open("wb") as f:
+        f.write(raw)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+    _CACHE.pop(str(path), None)
 
 def set_security_mode(path: Path, cfg: dict, mode: str) -> dict:
     updated = dict(cfg)
@@ -6,26 +6,44 @@ Spawned early by the main loader to give instant visual feedback.
 Closes automatically when the parent signals "close" through a Pipe.
 """
 from multiprocessing.connection import Connection
-from PyQt6.QtCore import QTimer
+from PyQt6.QtCore import QSocketNotifier, QTimer
 from PyQt6.QtWidgets import QApplication
 from .ui.splash import FunSplash
 import sys
 
+POLL_FALLBACK_MS = 200  # only used where the pipe can't be watched (Windows)
+
 
 def splash_process(conn: Connection, logo_path: str | None = None):
     app = QApplication(sys.argv)
     splash = FunSplash(logo_path=logo_path, closable=False, min_ms=1200)
     splash.show()
 
-    def poll_parent():
-        if conn.poll():
+    def poll_parent(*_):
+        try:
+            if not conn.poll(0):
+                return
             msg = conn.recv()
-            if msg == "close":
-                splash.request_close()
-                # allow the fade-out to complete before exit
-                QTimer.singleShot(600, app.quit)
+        except (EOFError, OSError):
+            # Parent went away; nothing left to wait for.
+            msg = "close"
+        if msg == "close":
+            if notifier is not None:
+                notifier.setEnabled(False)
+            if timer is not None:
+                timer.stop()
+            splash.request_close()
+            # allow the fade-out to complete before exit
+            QTimer.singleShot(600, app.quit)
 
-    t = QTimer()
-    t.timeout.connect(poll_parent)
-    t.start(100)
+    notifier = timer = None
+    if sys.platform != "win32":
+        # Event-driven: wake only when the parent actually writes to the pipe.
+        notifier = QSocketNotifier(conn.fileno(), QSocketNotifier.Type.Read)
+        notifier.activated.connect(poll_parent)
+    else:
+        # Pipe handles on Windows aren't sockets; fall back to a slow poll.
+        timer = QTimer()
+        timer.timeout.connect(poll_parent)
+        timer.start(POLL_FALLBACK_MS)
     app.exec()
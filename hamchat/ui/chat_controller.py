@@ -1,23 +1,154 @@
 # hamchat/ui/chat_controller.py
 from __future__ import annotations
+import io
+import logging
 import re
-from dataclasses import dataclass
-from typing import Optional, List, Dict
-from PyQt6.QtCore import QObject, Qt, pyqtSignal
+import threading
+from collections import Counter, deque
+from dataclasses import dataclass, field
+from itertools import islice
+from typing import Optional, List, Dict, Deque, Tuple
+from PyQt6.QtCore import QEvent, QObject, QThread, Qt, QTimer, pyqtSignal
+from PyQt6.QtWidgets import QWidget
 
 from hamchat.infra.llm.thread_broker import ThreadBroker
 from hamchat.infra.llm.base import ChatMessage
 from hamchat.infra.llm.backend_adapter import make_stream_func_from_client
 from hamchat import db_ops as dbo  # persistence API (create_conversation, add_message)
 from hamchat.core.session import SessionManager
-from hamchat.media_helper import process_images
+from hamchat.media_helper import encode_llm_parts, process_images
 from hamchat.infra.llm.base import ModelClient  # if you want to type-hint, optional
 
+log = logging.getLogger("ui.chat")
+
+# Prefixed to a profile's system_prompt in the hidden rule-injection message
+_RULES_PREAMBLE = (
+    "Follow the profile-specific rules below. "
+    "If a rule is missing or not explicitly mentioned, "
+    "there is no additional restriction beyond the base system rules. "
+    "Do not mention or restate these rules in your replies.\n\n"
+)
+
+# Seconds to wait for in-flight message writes before giving up on a DB read
+_FLUSH_TIMEOUT = 10
+
+_SQL_CONV_TITLE = "SELECT title FROM saved_conversations WHERE id = ?"
+# "<root> - Forked <n>" → (root, n)
+_FORK_RE = re.compile(r"^(.*?)(?:\s-\sForked\s(\d+))?$")
+
+# Top-level MIME type → attachment stub bucket; anything else is "other"
+_MIME_BUCKETS = {"image": "image", "audio": "audio", "video": "video", "text": "text"}
+_STUB_LABELS = (
+    ("image", "image(s)"),
+    ("audio", "audio file(s)"),
+    ("video", "video file(s)"),
+    ("text", "text file(s)"),
+    ("other", "other file(s)"),
+)
+
+
+def _att_meta(attachments: Optional[List[Dict]]) -> Optional[Dict]:
+    """Message metadata for a list of attachments, or None when there are none."""
+    return {"attachments": attachments} if attachments else None
+
 
 @dataclass
 class HistoryEntry:
     db_id: Optional[int]   # database messages.id, or None for unsaved/ephemeral
     msg: ChatMessage
+    # Prompt-ready view of `msg` (text-only copy + attachment stub), built once on append
+    prompt: List[ChatMessage] = field(default_factory=list)
+    # Logical (UI base) index, assigned on append
+    pos: int = -1
+
+
+def _write_batch(conn, writes: List[tuple]) -> List[tuple]:
+    """
+    Run queued (op, entry, fields) writes in one transaction, where op is a db_ops writer
+    taking commit=False (add_message, delete_many_messages). Returns (entry, row id) pairs
+    for the writes that carry an entry; the caller assigns them on the GUI thread.
+    All-or-nothing: on failure the batch is rolled back and every id is None.
+    """
+    saved: List[tuple] = []
+    try:
+        with conn:
+            for op, entry, fields in writes:
+                mid = op(conn, commit=False, **fields)
+                if entry is not None:
+                    saved.append((entry, int(mid)))
+    except Exception:
+        # do not break UX if persistence fails
+        return [(entry, None) for _, entry, _ in writes if entry is not None]
+    return saved
+
+
+class _PersistWorker(QObject):
+    """
+    Commits message batches on a background thread through its own connection
+    (sqlite3 connections can't be shared across threads), so commits never block the UI.
+    """
+
+    # Emitted after each batch; the controller then picks up the row ids on the GUI thread
+    saved = pyqtSignal()
+
+    def __init__(self, conn, on_done):
+        super().__init__()
+        self._conn = conn
+        self._on_done = on_done
+
+    def save_batch(self, writes):
+        ids: List[tuple] = []
+        try:
+            ids = _write_batch(self._conn, writes)
+        finally:
+            self._on_done(ids)
+            self.saved.emit()
+
+    def close(self):
+        try:
+            self._conn.close()
+        except Exception:
+            pass
+
+
+def _process_media(conn, attachments: List[str], options: Dict) -> tuple:
+    """
+    Run process_images(attachments, db=conn, **options) and return (batch, error message).
+    cas_put() leaves its files rows uncommitted, so they are committed here (rolled back on
+    failure); otherwise the connection would sit on SQLite's write lock until its next commit.
+    """
+    try:
+        if conn is None:
+            return process_images(attachments, **options), None
+        with conn:
+            return process_images(attachments, db=conn, **options), None
+    except Exception as e:
+        return None, str(e) or type(e).__name__
+
+
+class _MediaWorker(QObject):
+    """
+    Runs process_images() (hashing, thumbnailing, CAS writes) on a background thread through
+    its own connection, so large images don't stall the event loop.
+    """
+
+    # (continuation, process_images() batch or None, error message or None)
+    prepared = pyqtSignal(object, object, object)
+
+    def __init__(self, conn):
+        super().__init__()
+        self._conn = conn
+
+    def prepare(self, attachments, options, use_db, done):
+        batch, error = _process_media(self._conn if use_db else None, attachments, options)
+        self.prepared.emit(done, batch, error)
+
+    def close(self):
+        try:
+            if self._conn is not None:
+                self._conn.close()
+        except Exception:
+            pass
 
 
 class ChatController(QObject):
@@ -34,7 +165,13 @@ class ChatController(QObject):
     # Fired when we lazily create a saved_conversations row for a user chat
     conversation_started = pyqtSignal(int)  # conversation_id
     # Fired when we programmatically create a forked conversation and want the UI to open it
+    # (covers the conversation_started bookkeeping too; that signal isn't emitted for forks)
     forked_conversation = pyqtSignal(int)   # conversation_id
+    # Internal: hands a batch of queued message writes to the persistence thread
+    _save_requested = pyqtSignal(object)    # list[(op, HistoryEntry | None, fields)]; see _write_batch
+    # Internal: hands attachments to the media thread
+    # (attachments, process_images() options, use own connection, continuation)
+    _media_requested = pyqtSignal(object, object, bool, object)
 
     def __init__(        self,
         chat_display,
@@ -48,21 +185,52 @@ class ChatController(QObject):
         super().__init__(parent)
         self.chat = chat_display
         self.broker = ThreadBroker(self)
+        # Optional display capability, probed once rather than per turn
+        self._chat_has_pending = callable(getattr(chat_display, "get_pending_attachments", None))
 
         # Keep a handle to the client + current model so we can reconfigure later
         self._model_client = model_client
         self._model_name = model_name
 
         # ---- In-memory session history ----
-        self._history: List[HistoryEntry] = []
-        self._assistant_buf: List[str] = []
         self._max_turns: int = 512   # rolling window; adjust as needed
         # We should set the max turns in the session, load it from app.json, or infer it from spec report maybe
+        # Bounded window: appends past max_turns*2 evict the oldest entry in O(1).
+        self._history: Deque[HistoryEntry] = deque(maxlen=self._max_turns * 2)
+        # Number of entries evicted from the front, so UI base_index values still map onto _history
+        self._history_offset: int = 0
+        # Logical index where the prompt window starts. The window only grows (N → 2N turns) and
+        # then jumps forward to the last N, so the prompt prefix stays stable between jumps and
+        # backend prompt/KV caches keep hitting.
+        self._window_start: int = 0
+        # db_id → logical index, so message-id lookups don't scan the history
+        self._db_id_to_index: Dict[int, int] = {}
+        # Entries whose insert is queued/in flight, keyed by id(); see _apply_saved_ids
+        self._awaiting_ids: Dict[int, HistoryEntry] = {}
+        self._assistant_buf: io.StringIO = io.StringIO()
 
         # ---- Persistence context (optional; enabled only for role='user') ----
         self._db = db
         self._session = session
         self._conv_id: Optional[int] = None  # lazily created on first user msg
+        # Session-derived values read on every turn; kept current via sessionChanged
+        self._cached_uid: Optional[int] = None
+        self._save_on: bool = False
+        self._vision_on: bool = False
+        self._media_ephemeral: bool = True
+        self._cached_pid: Optional[int] = None
+        self._refresh_session_cache()
+        if session is not None and hasattr(session, "sessionChanged"):
+            session.sessionChanged.connect(self._refresh_session_cache)
+
+        # Persona injection read by _build_history; refreshed whenever a stream is set up
+        self._inj: Optional[ChatMessage] = None
+        # (profile id, injection) memo for system_injection_if_any; None results are cached too
+        self._inj_cache: Optional[tuple[Optional[int], Optional[ChatMessage]]] = None
+        # Text-path stream funcs keyed by (model_name, id(client)); see _cached_stream_func
+        self._stream_cache: Dict[tuple, object] = {}
+        # (client id, model, injection text) of the last _configure_stream; repeats are no-ops
+        self._last_config_key: Optional[tuple] = None
 
         # Build the initial streaming function for the starting model
         self._configure_stream()
@@ -72,35 +240,191 @@ class ChatController(QObject):
         self.chat.sig_stop_requested.connect(self._on_stop, Qt.ConnectionType.QueuedConnection)
 
         # Broker → UI
-        self.broker.job_token.connect(self._on_job_token, Qt.ConnectionType.QueuedConnection)
+        # ThreadBroker already re-emits worker tokens on the GUI thread (queued hop worker → broker),
+        # so a second queued hop here would only post another event per token.
+        self.broker.job_token.connect(self._on_job_token, Qt.ConnectionType.DirectConnection)
         self.broker.job_finished.connect(self._on_job_finished, Qt.ConnectionType.QueuedConnection)
         self.broker.job_error.connect(self._on_job_error, Qt.ConnectionType.QueuedConnection)
 
         self._active_row: Optional[int] = None
         self._active_ticket: int = -1
 
+        # Token coalescing (leading + trailing throttle): the first chunk after a quiet period
+        # is shown immediately, later ones are pushed at most once per frame (~60 Hz).
+        self._pending_chunks: List[str] = []
+        self._flush_timer = QTimer(self)
+        self._flush_timer.setInterval(16)
+        self._flush_timer.timeout.connect(self._flush_tokens)
+
+        # While the chat is hidden or its window minimized, tokens are only buffered; painting
+        # them would still run document layout nobody sees. The backlog is pushed on show/finish.
+        self._chat_visible: bool = True
+        self._watch_chat_visibility()
+
+        # Write-behind: message inserts are queued and committed together in one transaction
+        # shortly after the turn (or earlier, whenever something needs the DB ids). The user
+        # message waits for its reply, so a whole turn costs a single commit.
+        # (db_ops writer, entry awaiting its row id or None, kwargs); see _write_batch
+        self._pending_writes: List[tuple] = []
+        self._write_timer = QTimer(self)
+        self._write_timer.setSingleShot(True)
+        self._write_timer.setInterval(250)
+        self._write_timer.timeout.connect(self._dispatch_writes)
+
+        # Background writer, started on the first dispatched batch; without one (no DB /
+        # second connection unavailable) batches are written on the UI thread instead.
+        self._writes_in_flight: int = 0
+        self._writes_cv = threading.Condition()
+        # (entry, row id) pairs from finished batches, guarded by _writes_cv
+        self._landed_ids: List[tuple] = []
+        self._persist_thread: Optional[QThread] = None
+        self._persist_worker: Optional[_PersistWorker] = None
+        # Set once opening the writer's connection failed, so it isn't retried every batch
+        self._persist_unavailable: bool = False
+
+        # Media preparation thread; started on the first attachment send.
+        self._media_thread: Optional[QThread] = None
+        self._media_worker: Optional[_MediaWorker] = None
+
     def set_model_client(self, model_client) -> None:
         """
         Swap out the underlying LLM backend (e.g. OllamaClient vs OpenAIClient).
         Safe to call between requests; the new client will be used for the next prompt.
         """
+        if model_client is self._model_client:
+            return
+        # Funcs bound to the old backend would only keep it alive
+        self._stream_cache.clear()
         self._model_client = model_client
         self._configure_stream()
 
+    # ---------- History helpers ----------
+    def _append_history(self, entry: HistoryEntry) -> None:
+        """Append to the rolling window, tracking how many old entries fall off the front."""
+        entry.prompt = self._prompt_view(entry.msg)
+        if len(self._history) == self._history.maxlen:
+            self._unindex(self._history[0])
+            self._history_offset += 1
+        entry.pos = self._history_offset + len(self._history)
+        self._history.append(entry)
+        if entry.db_id is not None:
+            self._db_id_to_index[int(entry.db_id)] = entry.pos
+        end = self._history_offset + len(self._history)
+        if end - self._window_start >= self._max_turns * 2:
+            self._window_start = end - self._max_turns
+
+    def _unindex(self, entry: HistoryEntry) -> None:
+        """Drop an entry that is leaving the history from the db_id → index map."""
+        if entry.db_id is not None and self._db_id_to_index.get(int(entry.db_id)) == entry.pos:
+            del self._db_id_to_index[int(entry.db_id)]
+
+    def _apply_saved_ids(self) -> None:
+        """
+        Assign row ids handed back by the writer (see _on_batch_done) and index them.
+        Runs on the GUI thread: from the writer's queued `saved` signal, or right after a flush.
+        """
+        with self._writes_cv:
+            landed, self._landed_ids = self._landed_ids, []
+        for entry, mid in landed:
+            entry.db_id = mid
+            self._awaiting_ids.pop(id(entry), None)
+            # Failed writes leave db_id None; truncated/evicted entries no longer resolve
+            if mid is not None and self._history_entry_at(entry.pos) is entry:
+                self._db_id_to_index[mid] = entry.pos
+
+    def _clear_history(self) -> None:
+        self._history.clear()
+        self._history_offset = 0
+        self._window_start = 0
+        self._db_id_to_index.clear()
+        self._awaiting_ids.clear()
+
+    def _window_entries(self) -> List[HistoryEntry]:
+        """Snapshot of the entries inside the current prompt window (builders run on the worker thread)."""
+        start = max(0, self._window_start - self._history_offset)
+        # One copy of just the window; islice over a deque runs in C, so it can't interleave
+        # with GUI-thread appends.
+        return list(islice(self._history, start, None))
+
+    def _prompt_view(self, m: ChatMessage) -> List[ChatMessage]:
+        """Text-only copy of a history message plus an attachment stub, as sent to the LLM."""
+        out: List[ChatMessage] = []
+        # Only include a text message if there is actually text. A message without metadata
+        # (every assistant turn) is already prompt-ready, so it is shared rather than copied.
+        if m.content:
+            out.append(m if m.metadata is None else ChatMessage(role=m.role, content=m.content))
+        # For any message with attachments, add a stub. This runs once per entry at append time
+        # (user/media turns and conversation reloads alike); builders only read entry.prompt.
+        attachments = m.metadata.get("attachments") if m.metadata else None
+        if attachments:
+            stub = self._attachment_stub_for_model(attachments)
+            if stub:
+                out.append(ChatMessage(role="user", content=stub))
+        return out
+
+    def _build_history(self, _prompt: str = "", *, drop_last: bool = False, raw: bool = False) -> List[ChatMessage]:
+        """
+        Persona injection (if any) followed by the precomputed prompt view of the history.
+        Shared by every stream func as its build_messages; drop_last leaves out the newest turn.
+        raw=True uses the messages as recorded instead (no attachment stubs), for the media path.
+        """
+        inj = self._inj
+        hist: List[ChatMessage] = [inj] if inj is not None else []
+        entries = self._window_entries()
+        if drop_last:
+            entries = entries[:-1]
+        if raw:
+            hist.extend(entry.msg for entry in entries)
+            return hist
+        for entry in entries:
+            hist.extend(entry.prompt)
+        return hist
+
+    @staticmethod
+    def _stream_options() -> dict:
+        return {"temperature": 0.7}
+
+    def _history_entry_at(self, base_index) -> Optional[HistoryEntry]:
+        """Map a logical (UI) message index onto the rolling window, or None if out of range/evicted."""
+        if not isinstance(base_index, int):
+            return None
+        i = base_index - self._history_offset
+        if not (0 <= i < len(self._history)):
+            return None
+        return self._history[i]
+
     # ---------- Persistence helpers ----------
-    def _save_enabled(self) -> bool:
+    def _refresh_session_cache(self, *_args) -> None:
         """
-        Saving is enabled only when a real user (not guest/admin) is chatting.
+        Recompute the cached user id, profile id, save flag and media mode. Runs on init and on every
+        SessionManager.sessionChanged (login, logout, profile switch, vision toggle).
         """
         try:
-            return (
+            cur = self._session.current if self._session is not None else None
+            uid = getattr(cur, "user_id", None)
+            role = getattr(cur, "role", "guest")
+            self._cached_uid = int(uid) if uid is not None else None
+            self._save_on = (
                     self._db is not None
-                    and self._session is not None
-                    and getattr(self._session.current, "role", "guest") == "user"
-                    and self._session.current.user_id is not None
+                    and role == "user"
+                    and self._cached_uid is not None
             )
+            self._vision_on = bool(getattr(cur, "vision", False))
+            self._cached_pid = self._read_profile_id()
+            # Only real users get media stored in CAS; guests/admins use a temp copy
+            self._media_ephemeral = role != "user"
         except Exception:
-            return False
+            self._cached_uid = None
+            self._save_on = False
+            self._vision_on = False
+            self._media_ephemeral = True
+            self._cached_pid = None
+
+    def _save_enabled(self) -> bool:
+        """
+        Saving is enabled only when a real user (not guest/admin) is chatting.
+        """
+        return self._save_on
 
     def _ensure_conversation(self, title: str) -> None:
         if self._conv_id or not self._save_enabled():
@@ -110,41 +434,172 @@ class ChatController(QObject):
         if len(safe_title) > 80:
             safe_title = safe_title[:80] + "…"
         try:
-            uid = int(self._session.current.user_id)  # type: ignore
-            self._conv_id = dbo.create_conversation(self._db, user_id=uid, title=safe_title)
+            uid = self._cached_uid
+            # Stored as int once here (and in load_conversation) so hot paths skip the coercion
+            self._conv_id = int(dbo.create_conversation(self._db, user_id=uid, title=safe_title))
             # Notify listeners (e.g., MainWindow → SidePanel) that a new convo exists
-            self.conversation_started.emit(int(self._conv_id))
+            self.conversation_started.emit(self._conv_id)
         except Exception:
             # Do not break UX if saving fails
             self._conv_id = None
 
+    def _queue_write(self, entry: Optional[HistoryEntry], *, defer: bool = False, **fields) -> None:
+        """
+        Queue a dbo.add_message(**fields) call. Once the batch lands, the new row id is stored
+        on `entry.db_id` (if an entry is given). With defer=True the write just waits for the
+        next scheduled batch (or an explicit flush) instead of arming the timer itself.
+        """
+        self._pending_writes.append((dbo.add_message, entry, fields))
+        if entry is not None:
+            self._awaiting_ids[id(entry)] = entry
+        if not defer:
+            self._schedule_writes()
+
+    def _queue_truncate(self, message_id: int, *, defer: bool = False) -> None:
+        """
+        Queue deletion of this conversation's messages from message_id on. Ahead of a resend
+        it is deferred, so it commits together with the replayed turn in one transaction.
+        """
+        self._pending_writes.append((
+            dbo.delete_many_messages,
+            None,
+            {"conversation_id": self._conv_id, "message_id": message_id},
+        ))
+        if not defer:
+            self._schedule_writes()
+
+    def _schedule_writes(self) -> None:
+        if self._pending_writes and not self._write_timer.isActive():
+            self._write_timer.start()
+
+    def _start_persist_worker(self) -> None:
+        try:
+            # The writer thread is the only user of this connection from here on
+            conn = dbo.open_connection(check_same_thread=False)
+        except Exception:
+            self._persist_unavailable = True
+            return
+        self._persist_thread = QThread(self)
+        self._persist_worker = _PersistWorker(conn, self._on_batch_done)
+        self._persist_worker.moveToThread(self._persist_thread)
+        self._save_requested.connect(self._persist_worker.save_batch, Qt.ConnectionType.QueuedConnection)
+        self._persist_worker.saved.connect(self._apply_saved_ids, Qt.ConnectionType.QueuedConnection)
+        self._persist_thread.start()
+
+    def _stop_persist_worker(self) -> None:
+        if self._persist_thread is not None:
+            self._persist_thread.quit()
+            self._persist_thread.wait()
+            self._persist_thread = None
+        if self._persist_worker is not None:
+            self._persist_worker.close()
+            self._persist_worker = None
+
+    def _start_media_worker(self) -> bool:
+        conn = None
+        if self._db is not None:
+            try:
+                # CAS rows for attachments are written on the media thread through this one
+                conn = dbo.open_connection(check_same_thread=False)
+            except Exception:
+                return False
+        self._media_thread = QThread(self)
+        self._media_worker = _MediaWorker(conn)
+        self._media_worker.moveToThread(self._media_thread)
+        self._media_requested.connect(self._media_worker.prepare, Qt.ConnectionType.QueuedConnection)
+        self._media_worker.prepared.connect(self._on_media_prepared, Qt.ConnectionType.QueuedConnection)
+        self._media_thread.start()
+        return True
+
+    def _stop_media_worker(self) -> None:
+        if self._media_thread is not None:
+            self._media_thread.quit()
+            self._media_thread.wait()
+            self._media_thread = None
+        if self._media_worker is not None:
+            self._media_worker.close()
+            self._media_worker = None
+
+    def _on_batch_done(self, ids: List[tuple]) -> None:
+        # Runs on the persistence thread; ids are only handed over, never assigned, here.
+        with self._writes_cv:
+            self._landed_ids.extend(ids)
+            self._writes_in_flight -= 1
+            self._writes_cv.notify_all()
+
+    def _dispatch_writes(self) -> None:
+        """Hand all queued message inserts to the writer as one batch (one transaction)."""
+        self._write_timer.stop()
+        if not self._pending_writes:
+            return
+        writes, self._pending_writes = self._pending_writes, []
+        if self._persist_worker is None and not self._persist_unavailable:
+            self._start_persist_worker()
+        if self._persist_worker is None:
+            ids = _write_batch(self._db, writes)
+            with self._writes_cv:
+                self._landed_ids.extend(ids)
+            self._apply_saved_ids()
+            return
+        with self._writes_cv:
+            self._writes_in_flight += 1
+        self._save_requested.emit(writes)
+
+    def flush_pending_writes(self) -> bool:
+        """
+        Commit all queued message inserts and wait until they have landed.
+        Call before reading messages back from the DB (fork, file lookups, ...); returns at
+        once when nothing is in flight. Returns False if the writer did not finish in time,
+        in which case the caller should abort whatever needed the rows.
+        """
+        self._dispatch_writes()
+        with self._writes_cv:
+            landed = self._writes_cv.wait_for(lambda: self._writes_in_flight == 0, timeout=_FLUSH_TIMEOUT)
+        self._apply_saved_ids()
+        if not landed:
+            log.warning("message writes still in flight after %ss; aborting", _FLUSH_TIMEOUT)
+        return landed
+
+    def _await_db_id(self, entry: HistoryEntry) -> bool:
+        """
+        Make sure `entry` has its row id if its insert is still queued or in flight.
+        Blocks only in that case; returns False if the flush timed out.
+        """
+        if entry.db_id is not None or id(entry) not in self._awaiting_ids:
+            return True
+        return self.flush_pending_writes()
+
     def _persist_user_with_attachments(
         self,
+        entry: HistoryEntry,
         text: str,
-        attachments_meta: Optional[List[Dict]] = None,
-    ) -> Optional[int]:
+    ) -> None:
         """
-        Persist a user message with attachments and return the DB message id, or None on failure.
+        Queue a user message with attachments for persistence; `entry.db_id` is filled in on flush.
+        The row's metadata is the entry's own attachment metadata (built once via _att_meta).
         """
         if not self._save_enabled():
-            return None
+            return
         try:
             self._ensure_conversation(text)
             if not self._conv_id:
-                return None
-            uid = int(self._session.current.user_id)  # type: ignore
-            mid = dbo.add_message(
-                self._db,
-                conversation_id=int(self._conv_id),
+                return
+            uid = self._cached_uid
+            # Held until the job finishes so it commits in the same transaction as the reply.
+            # Trade-off: if the app dies mid-stream the unsent prompt is lost with it; a stop or
+            # error (see _on_stop / _on_job_error) writes it straight away instead.
+            self._queue_write(
+                entry,
+                defer=True,
+                conversation_id=self._conv_id,
                 sender_type="user",
                 sender_id=uid,
                 content=text,
-                metadata={"attachments": attachments_meta} if attachments_meta else None,
+                metadata=entry.msg.metadata,
             )
-            return int(mid)
         except Exception:
             # do not break UX if persistence fails
-            return None
+            pass
 
     # ---- helpers for forking ----------------------------------------
 
@@ -155,16 +610,13 @@ class ChatController(QObject):
         if not self._db or not self._conv_id:
             return "Forked chat"
 
-        cur = self._db.cursor()
-        cur.execute(
-            "SELECT title FROM saved_conversations WHERE id = ?",
-            (int(self._conv_id),),
-        )
-        row = cur.fetchone()
+        row = self._db.execute(_SQL_CONV_TITLE, (self._conv_id,)).fetchone()
         base = (row[0] if row and row[0] else "Untitled").strip()
 
-        # Extract root + existing fork number, if any.
-        m = re.match(r"^(.*?)(?:\s-\sForked\s(\d+))?$", base)
+        # Extract root + existing fork number, if any (only titles mentioning a fork can match).
+        if "Forked" not in base:
+            return f"{base} - Forked 1"
+        m = _FORK_RE.match(base)
         if m:
             root = (m.group(1) or "").strip()
             num = m.group(2)
@@ -209,7 +661,12 @@ class ChatController(QObject):
         Returns:
             - int id for a real profile
             - 0 or None for the synthetic 'Default' / no persona
+
+        Cached by _refresh_session_cache (set_profile_id emits sessionChanged).
         """
+        return self._cached_pid
+
+    def _read_profile_id(self) -> Optional[int]:
         try:
             if self._session is None:
                 return None
@@ -240,38 +697,45 @@ class ChatController(QObject):
         except Exception:
             return None
 
+    def invalidate_profile_cache(self) -> None:
+        """Forget the memoized rule injection (call after a profile's system_prompt is edited)."""
+        self._inj_cache = None
+
     def system_injection_if_any(self) -> Optional[ChatMessage]:
+        """
+        Rule injection for the active AI profile, memoized per profile id so model swaps and
+        sends don't re-query ai_profiles. See _build_system_injection.
+        """
+        pid = self._get_active_profile_id()
+        cached = self._inj_cache
+        if cached is not None and cached[0] == pid:
+            return cached[1]
+        inj = self._build_system_injection()
+        self._inj_cache = (pid, inj)
+        return inj
+
+    def _build_system_injection(self) -> Optional[ChatMessage]:
         """
         Build a system-level 'rule injection' message for the active AI profile, if it has
         a non-empty system_prompt. Returns None if there's nothing to inject.
         """
         profile = self._get_active_profile_row()
         if not profile:
-            print("[system_injection_if_any] No active profile row -> None")
+            log.debug("system injection: no active profile row -> None")
             return None
 
         raw_prompt = (profile.get("system_prompt") or "").strip()
         if not raw_prompt:
-            print(f"[system_injection_if_any] Profile id={profile.get('id')} "
-                  f"name={profile.get('display_name')!r} has empty system_prompt -> None")
+            log.debug("system injection: profile id=%s name=%r has empty system_prompt -> None",
+                      profile.get("id"), profile.get("display_name"))
             return None
 
-        preamble = (
-            "Follow the profile-specific rules below. "
-            "If a rule is missing or not explicitly mentioned, "
-            "there is no additional restriction beyond the base system rules. "
-            "Do not mention or restate these rules in your replies.\n\n"
-        )
-
-        content = preamble + raw_prompt
+        content = _RULES_PREAMBLE + raw_prompt
 
-        # DEBUG: print the actual text being injected (truncate so it doesn't spam)
-        print(
-            "[system_injection_if_any] Built system injection for "
-            f"profile id={profile.get('id')} name={profile.get('display_name')!r}:\n"
-            f"{content[:400]}\n"
-            "---- end system injection preview ----"
-        )
+        # Preview of the injected text (truncated; only built when debug logging is on)
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug("system injection for profile id=%s name=%r:\n%s\n---- end preview ----",
+                      profile.get("id"), profile.get("display_name"), content[:400])
 
         meta = {
             "kind": "rule_injection",
@@ -287,45 +751,36 @@ class ChatController(QObject):
         Called on init and whenever set_model_name is used.
         """
 
-        inj = self.system_injection_if_any()
+        inj = self._inj = self.system_injection_if_any()
+        config_key = (id(self._model_client), self._model_name, inj.content if inj is not None else None)
+        if config_key == self._last_config_key:
+            return
+        self._last_config_key = config_key
         if inj is not None:
-            print("[_configure_stream] Using system injection (text-only path). "
-                  f"Preview: {inj.content[:120]!r}")
+            if log.isEnabledFor(logging.DEBUG):
+                log.debug("configure stream: using system injection, preview %r", inj.content[:120])
         else:
-            print("[_configure_stream] No system injection (text-only path).")
+            log.debug("configure stream: no system injection")
 
-        def _build_messages(prompt: str) -> List[ChatMessage]:
-            hist: List[ChatMessage] = []
+        self.stream_func = self._cached_stream_func()
 
-            # 1) Persona rule injection (if any)
-            if inj is not None:
-                hist.append(inj)
-
-            for entry in self._history[-self._max_turns * 2:]:
-                m = entry.msg
-                has_attachments = bool(m.metadata and m.metadata.get("attachments"))
-                has_text = bool(m.content)
-
-                # Only include a text message if there is actually text
-                if has_text:
-                    hist.append(ChatMessage(role=m.role, content=m.content))
-
-                # For any message with attachments, add a stub
-                if has_attachments:
-                    stub = self._attachment_stub_for_model(m.metadata["attachments"])
-                    if stub:
-                        hist.append(ChatMessage(role="user", content=stub))
-            return hist
-
-        def _build_options() -> dict:
-            return {"temperature": 0.7}
-
-        self.stream_func = make_stream_func_from_client(
-            self._model_client,
-            model=self._model_name,
-            build_messages=_build_messages,
-            build_options=_build_options,
-        )
+    def _cached_stream_func(self):
+        """
+        Text-path stream func for the current (model, client). The builders are bound methods
+        that read live state, so a func built once stays valid; toggling models is a dict hit.
+        """
+        # The cached func holds the client, so its id() can't be recycled while the entry lives.
+        key = (self._model_name, id(self._model_client))
+        func = self._stream_cache.get(key)
+        if func is None:
+            func = make_stream_func_from_client(
+                self._model_client,
+                model=self._model_name,
+                build_messages=self._build_history,
+                build_options=self._stream_options,
+            )
+            self._stream_cache[key] = func
+        return func
 
     def set_model_name(self, model_name: str) -> None:
         """
@@ -346,178 +801,174 @@ class ChatController(QObject):
         Handle a plain-text user turn.
 
         - Optionally grabs pending attachments from the UI (for metadata only).
-        - Persists to DB first (if enabled) and captures the message row id.
         - Appends a ChatMessage with metadata for attachments.
+        - Queues the message for persistence (if enabled); its row id lands on the entry.
         """
         # Reset assistant buffer for this turn
-        self._assistant_buf = []
+        self._assistant_buf = io.StringIO()
+        # Pick up profile switches since the stream was configured (memoized, so usually free)
+        self._inj = self.system_injection_if_any()
 
         # Optional metadata: include pending attachments if any
         attachments_meta: List[Dict] = []
-        if hasattr(self.chat, "get_pending_attachments"):
+        if self._chat_has_pending:
             try:
                 attachments_meta = self.chat.get_pending_attachments() or []
             except Exception:
                 attachments_meta = []
 
-        base_meta: Optional[Dict] = {"attachments": attachments_meta} if attachments_meta else None
-
-        # --- Persistence: create conversation (first turn) + save user message
-        msg_db_id: Optional[int] = None
-        if self._save_enabled():
-            try:
-                self._ensure_conversation(text)
-                if self._conv_id:
-                    msg_db_id = dbo.add_message(
-                        self._db,
-                        conversation_id=int(self._conv_id),
-                        sender_type="user",
-                        sender_id=int(self._session.current.user_id),  # type: ignore
-                        content=text,
-                        metadata=base_meta,
-                    )
-                    if msg_db_id is not None:
-                        msg_db_id = int(msg_db_id)
-            except Exception:
-                # ignore persistence errors; keep chat flowing
-                msg_db_id = None
-
-        # Build metadata for in-memory history (attachments only)
-        msg_metadata: Optional[Dict] = dict(base_meta) if base_meta else None
-
-        # Record user turn into the rolling history
+        # Record user turn into the rolling history; db_id is filled in when the write flushes
         msg = ChatMessage(
             role="user",
             content=text,
-            metadata=msg_metadata or None,   # attachments only
-        )
-        self._history.append(
-            HistoryEntry(
-                db_id=msg_db_id,
-                msg=msg,
-            )
+            metadata=_att_meta(attachments_meta),   # attachments only
         )
+        entry = HistoryEntry(db_id=None, msg=msg)
+        self._append_history(entry)
 
         # Prepare UI row and kick off background job
         self._active_row = self.chat.begin_assistant_stream()
         self.chat.set_streaming(True)
         self._active_ticket = self.broker.submit(self.stream_func, text)
 
+        # --- Persistence: create conversation (first turn) + queue user message.
+        # Done after submit so the request is already in flight; the job's finished signal
+        # is queued, so _conv_id is always set before the assistant turn is recorded.
+        self._persist_user_with_attachments(entry, text)
+
     def send_user_with_media(self, text: str, llm_parts: List[Dict], attachments_meta: Optional[List[Dict]] = None):
         """
         Send a user turn that includes vision parts (base64 images).
         Media parts go to the backend via llm_parts; metadata tracks attachments for history.
         """
-        # Persist first (if enabled) and capture DB row id
-        msg_db_id = self._persist_user_with_attachments(text, attachments_meta)
-
-        # Build metadata for in-memory ChatMessage
-        meta: Dict = {}
-        if attachments_meta:
-            meta["attachments"] = attachments_meta
-
         # Record user turn (even if text == "" for image-only)
         msg = ChatMessage(
             role="user",
             content=text or "",
-            metadata=meta or None,
+            metadata=_att_meta(attachments_meta),
         )
-        self._history.append(
-            HistoryEntry(
-                db_id=msg_db_id,
-                msg=msg,
-            )
-        )
-        self._assistant_buf = []
+        entry = HistoryEntry(db_id=None, msg=msg)
+        self._append_history(entry)
+
+        self._assistant_buf = io.StringIO()
 
         self._active_row = self.chat.begin_assistant_stream()
         self.chat.set_streaming(True)
 
         # Compute persona rule injection once, in the GUI thread
-        inj = self.system_injection_if_any()
+        self._inj = self.system_injection_if_any()
 
         # submit a one-off stream function that wraps the standard messages/options
         def build_messages(prompt: str) -> List[ChatMessage]:
-            # Start from the raw history messages (we don't want stubs here; the
-            # images are passed via llm_parts instead)
-            hist_entries = self._history[-self._max_turns * 2:]
-            hist = [entry.msg for entry in hist_entries]
-
-            # Persona rule injection at the front, if any
-            prefix: List[ChatMessage] = [inj] if inj is not None else []
-
-            # replace the last (just-appended) user turn with a copy that has .parts
+            # The just-appended user turn goes out with its images (via .parts)
+            # rather than its attachment stub.
             msg = ChatMessage(role="user", content=prompt)
-            setattr(msg, "parts", llm_parts)  # <-- important: keep it an object
-
-            if hist:
-                hist = [*hist[:-1], msg]
-            else:
-                hist = [msg]
-
-            return [*prefix, *hist]
-
-        def build_options() -> dict:
-            return {"temperature": 0.7}
+            # Runs on the broker thread, so encoding multi-MB images doesn't stall the UI
+            setattr(msg, "parts", encode_llm_parts(llm_parts))  # <-- important: keep it an object
+            # Raw history, as before the shared builder: no stubs here, the images travel as parts
+            hist = self._build_history(drop_last=True, raw=True)
+            hist.append(msg)
+            return hist
 
         stream_func = make_stream_func_from_client(
             self._model_client,
             model=self._model_name,
             build_messages=build_messages,
-            build_options=build_options,
+            build_options=self._stream_options,
         )
 
         self._active_ticket = self.broker.submit(stream_func, text)
 
+        # Persist (if enabled) once the request is in flight, as in _on_user_text
+        self._persist_user_with_attachments(entry, text)
+
     def _on_stop(self):
         self.broker.stop_active()
+        # No reply to wait for any more; commit the deferred user row now
+        self._schedule_writes()
 
     def _on_job_token(self, ticket: int, chunk: str):
-        if ticket == self._active_ticket and self._active_row is not None:
-            self._assistant_buf.append(chunk)
-            self.chat.stream_chunk(self._active_row, chunk)
+        # Hot path (once per token): keep it to the two buffer appends and one timer check.
+        if ticket != self._active_ticket or self._active_row is None:
+            return
+        self._assistant_buf.write(chunk)
+        self._pending_chunks.append(chunk)
+        timer = self._flush_timer
+        if self._chat_visible and not timer.isActive():
+            # Leading edge: paint right away, then throttle until the stream goes quiet.
+            self._flush_tokens()
+            timer.start()
+
+    def _flush_tokens(self, force: bool = False) -> None:
+        """Push any coalesced chunks to the display as a single stream_chunk call."""
+        pending = self._pending_chunks
+        if not pending or not (force or self._chat_visible):
+            self._flush_timer.stop()
+            return
+        self._pending_chunks = []
+        row = self._active_row
+        if row is not None:
+            self.chat.stream_chunk(row, pending[0] if len(pending) == 1 else "".join(pending))
+
+    def _stop_flush(self) -> None:
+        """Flush whatever is still buffered and stop the coalescing timer."""
+        self._flush_tokens(force=True)
+        self._flush_timer.stop()
+
+    # ---------- Display visibility ----------
+    def _watch_chat_visibility(self) -> None:
+        if not isinstance(self.chat, QWidget):
+            return
+        self.chat.installEventFilter(self)
+        win = self.chat.window()
+        if win is not self.chat:
+            win.installEventFilter(self)
+        self._chat_visible = self.chat.isVisible() and not win.isMinimized()
+
+    def eventFilter(self, obj, event) -> bool:
+        et = event.type()
+        if et in (QEvent.Type.Show, QEvent.Type.Hide, QEvent.Type.WindowStateChange):
+            chat = self.chat
+            visible = chat.isVisible() and not chat.window().isMinimized()
+            if visible != self._chat_visible:
+                self._chat_visible = visible
+                if visible and self._pending_chunks:
+                    # Catch up with everything streamed while hidden in one paint
+                    self._flush_tokens()
+        return super().eventFilter(obj, event)
 
     def _on_job_finished(self, ticket: int, status: str):
         if ticket == self._active_ticket and self._active_row is not None:
+            self._stop_flush()
             self.chat.end_assistant_stream(self._active_row)
 
-        # Commit assistant turn iff we received any content
-        if self._assistant_buf:
-            final_text = "".join(self._assistant_buf)
-            msg_db_id: Optional[int] = None
+        # Commit assistant turn iff we received any content. Swap the buffer out first so the
+        # streamed text is only held once (as final_text) while it is recorded.
+        final_text = self._assistant_buf.getvalue()
+        self._assistant_buf = io.StringIO()
+        if final_text:
+            msg = ChatMessage(role="assistant", content=final_text)
+            entry = HistoryEntry(db_id=None, msg=msg)
+            self._append_history(entry)
+
             if self._save_enabled() and self._conv_id:
                 try:
-                    prof_id = None
-                    try:
-                        prof_id = self._session.get_profile_id() if hasattr(self._session, "get_profile_id") else None
-                    except Exception:
-                        prof_id = None
-
                     # Treat synthetic default (0) as "no profile" for storage
-                    if prof_id in (0, "0"):
-                        prof_id = None
-
-                    msg_db_id = int(
-                        dbo.add_message(
-                            self._db,
-                            conversation_id=int(self._conv_id),
-                            sender_type="assistant",
-                            sender_id=prof_id,
-                            content=final_text,
-                            metadata=None,
-                        )
+                    prof_id = self._cached_pid or None
+
+                    self._queue_write(
+                        entry,
+                        conversation_id=self._conv_id,
+                        sender_type="assistant",
+                        sender_id=prof_id,
+                        content=final_text,
+                        metadata=None,
                     )
                 except Exception:
-                    msg_db_id = None
+                    pass
 
-            msg = ChatMessage(role="assistant", content=final_text)
-            self._history.append(
-                HistoryEntry(
-                    db_id=msg_db_id,
-                    msg=msg,
-                )
-            )
-        self._assistant_buf = []
+        # Covers turns that ended without a reply (error/stop) but still have a user row queued
+        self._schedule_writes()
 
         self.chat.set_streaming(False)
         self._active_row = None
@@ -525,9 +976,13 @@ class ChatController(QObject):
 
     def _on_job_error(self, ticket: int, message: str):
         if ticket == self._active_ticket and self._active_row is not None:
-            self.chat.stream_chunk(self._active_row, f"\n[error] {message}")
-        # Do not record an assistant turn on error (unless you want partials)
-        self._assistant_buf = []
+            # Ride along with the final coalesced flush: one stream_chunk instead of two
+            self._pending_chunks.append(f"\n[error] {message}")
+            self._stop_flush()
+        # Do not record an assistant turn on error (unless you want partials), but still
+        # commit the deferred user row
+        self._assistant_buf = io.StringIO()
+        self._schedule_writes()
         self.chat.set_streaming(False)
         self._active_row = None
         self._active_ticket = -1
@@ -535,8 +990,10 @@ class ChatController(QObject):
     # ---- Optional helpers ----
     def reset_history(self):
         """Call when starting a brand-new conversation (e.g., 'New chat')."""
-        self._history.clear()
-        self._assistant_buf = []
+        # Queued rows carry their own conversation id; hand them off, no need to wait
+        self._dispatch_writes()
+        self._clear_history()
+        self._assistant_buf = io.StringIO()
         # Drop the persisted-conversation handle; next user msg will create a new one
         self._conv_id = None
 
@@ -560,22 +1017,26 @@ class ChatController(QObject):
             needle = int(message_id)
         except Exception:
             return None
-        for idx, entry in enumerate(self._history):
-            if entry.db_id is not None and int(entry.db_id) == needle:
-                return idx
-        return None
+        if needle not in self._db_id_to_index and self._awaiting_ids:
+            # The row may belong to an insert that hasn't reported its id yet
+            if not self.flush_pending_writes():
+                return None
+        return self._db_id_to_index.get(needle)
 
     def load_conversation(self, conversation_id: int, messages: list[dict]) -> None:
         """
         Attach the controller to an existing saved conversation.
         `messages` should be rows from db_ops.list_messages().
         """
-        self._history.clear()
-        self._assistant_buf = []
+        # The caller flushed before reading `messages`; hand off anything queued since
+        self._dispatch_writes()
+        self._clear_history()
+        self._assistant_buf = io.StringIO()
         self._conv_id = int(conversation_id)
 
         insert_offset = 0  # tracks extra rows added for thumbs so indices stay aligned
         ui_row = -1
+        cas_paths = self._resolve_thumb_paths(messages)
 
         for m in messages:
             msg_db_id = m.get("id")
@@ -597,7 +1058,7 @@ class ChatController(QObject):
             # Always put the logical message into _history if there's text or attachments.
             # This keeps LLM context consistent for reloads.
             msg = ChatMessage(role=role, content=text or "", metadata=metadata or None)
-            self._history.append(
+            self._append_history(
                 HistoryEntry(
                     db_id=int(msg_db_id) if msg_db_id is not None else None,
                     msg=msg,
@@ -608,23 +1069,11 @@ class ChatController(QObject):
             if text:
                 ui_row += 1
 
-            if role == "user" and attachments and getattr(self, "chat", None):
+            if role == "user" and attachments:
                 thumb_paths: list[str] = []
                 for att in attachments:
                     if isinstance(att, dict):
-                        thumb_id = att.get("thumb_file_id")
-                        file_id = att.get("file_id")
-                        path = None
-                        if thumb_id is not None and self._db is not None:
-                            try:
-                                path = dbo.cas_path_for_file(self._db, int(thumb_id))
-                            except Exception:
-                                path = None
-                        if path is None and file_id is not None and self._db is not None:
-                            try:
-                                path = dbo.cas_path_for_file(self._db, int(file_id))
-                            except Exception:
-                                path = None
+                        path = self._att_thumb_path(att, cas_paths)
                         if path:
                             thumb_paths.append(str(path))
                     elif isinstance(att, str):
@@ -639,6 +1088,56 @@ class ChatController(QObject):
                     except Exception:
                         pass
 
+    @staticmethod
+    def _att_thumb_path(att: dict, cas_paths: dict):
+        """Thumbnail path for an attachment dict, falling back to the full file."""
+        for key in ("thumb_file_id", "file_id"):
+            fid = att.get(key)
+            if fid is None:
+                continue
+            try:
+                path = cas_paths.get(int(fid))
+            except (TypeError, ValueError):
+                path = None
+            if path is not None:
+                return path
+        return None
+
+    def _resolve_thumb_paths(self, messages: list[dict]) -> dict:
+        """
+        CAS paths for every attachment thumbnail in a conversation, in batched lookups rather than
+        one query per attachment. Full-file ids are only resolved for thumbs that didn't resolve.
+        """
+        if self._db is None:
+            return {}
+        atts: List[Dict] = []
+        for m in messages:
+            if m.get("sender_type", "assistant") != "user":
+                continue
+            for att in (m.get("metadata") or {}).get("attachments") or []:
+                if isinstance(att, dict):
+                    atts.append(att)
+        if not atts:
+            return {}
+
+        def _ids(key: str, rows: List[Dict]) -> List[int]:
+            out: List[int] = []
+            for att in rows:
+                try:
+                    out.append(int(att[key]))
+                except (KeyError, TypeError, ValueError):
+                    pass
+            return out
+
+        try:
+            paths = dbo.cas_paths_for_files(self._db, _ids("thumb_file_id", atts))
+            missing = [a for a in atts if self._att_thumb_path(a, paths) is None]
+            if missing:
+                paths.update(dbo.cas_paths_for_files(self._db, _ids("file_id", missing)))
+        except Exception:
+            return {}
+        return paths
+
     def resend_message(self, index: int):
         """Resend from this user message: truncate after it, then replay it."""
         payload = self._get_user_payload(index)
@@ -650,14 +1149,11 @@ class ChatController(QObject):
         msg_id = payload.get("message_id")
         base_index = payload.get("base_index")
 
-        # 1) Persisted truncate (if we have a real conversation + message id)
+        # 1) Persisted truncate (if we have a real conversation + message id). Deferred, so the
+        #    delete and the replayed user/assistant rows land in a single transaction.
         if self._save_enabled() and self._db is not None and self._conv_id and msg_id:
             try:
-                dbo.delete_many_messages(
-                    self._db,
-                    conversation_id=int(self._conv_id),
-                    message_id=int(msg_id),
-                )
+                self._queue_truncate(int(msg_id), defer=True)
             except Exception:
                 pass
 
@@ -679,6 +1175,8 @@ class ChatController(QObject):
             self._send_with_attachments(text, attachments)
         else:
             if not text:
+                # Nothing to replay; commit the truncate on its own
+                self._schedule_writes()
                 return
             # Append a new user bubble and stream as usual
             self.chat.append_message("user", text)
@@ -717,11 +1215,7 @@ class ChatController(QObject):
         # 1) Persisted truncate (if we have a real conversation + message id)
         if self._save_enabled() and self._db is not None and self._conv_id and msg_id:
             try:
-                dbo.delete_many_messages(
-                    self._db,
-                    conversation_id=int(self._conv_id),
-                    message_id=int(msg_id),
-                )
+                self._queue_truncate(int(msg_id))
             except Exception:
                 pass
 
@@ -759,7 +1253,7 @@ class ChatController(QObject):
         if not self._save_enabled() or not self._db or not self._conv_id:
             self.resend_message(index)
             return
-        if not self._session or self._session.current.user_id is None:
+        if self._cached_uid is None:
             return
 
         # Get the raw payload so we know which role we're forking on.
@@ -795,19 +1289,21 @@ class ChatController(QObject):
 
         # Map base_index → HistoryEntry → db_id, if we don't already have it.
         if pivot_msg_id is None:
-            if not isinstance(base_index, int):
-                return
-            if not (0 <= base_index < len(self._history)):
+            entry = self._history_entry_at(base_index)
+            if entry is None or not self._await_db_id(entry):
                 return
-            entry = self._history[base_index]
             pivot_msg_id = entry.db_id
 
         if pivot_msg_id is None:
             # Message isn't in DB (unsaved / ephemeral thread) → nothing to fork.
             return
 
+        # The copy below reads the source rows back; they must have landed first.
+        if not self.flush_pending_writes():
+            return
+
         # Create the forked conversation with an appropriate title.
-        uid = int(self._session.current.user_id)  # type: ignore
+        uid = self._cached_uid
         new_title = self._make_fork_title()
         try:
             new_conv_id = dbo.create_conversation(self._db, user_id=uid, title=new_title)
@@ -816,39 +1312,20 @@ class ChatController(QObject):
 
         # Copy messages from the old conversation up to the pivot.
         include_pivot = (role == "assistant")
+        # One INSERT ... SELECT for the whole copy; if it fails (it's all-or-nothing), redo it
+        # row by row so a single bad row doesn't cost the fork its history.
         try:
-            rows = dbo.list_messages(self._db, int(self._conv_id), limit=1000000)
+            dbo.clone_messages_bulk(self._db, self._conv_id, new_conv_id, pivot_msg_id, include_pivot)
         except Exception:
-            rows = []
-
-        for row in rows:
-            mid = row.get("id")
-            if mid is None:
-                continue
-
-            if mid < pivot_msg_id:
+            try:
+                rows = dbo.list_messages_up_to(self._db, self._conv_id, pivot_msg_id, include_pivot)
+            except Exception:
+                rows = []
+            for row in rows:
                 self._clone_message_to_conversation(new_conv_id, row)
-            elif mid == pivot_msg_id:
-                if include_pivot:
-                    self._clone_message_to_conversation(new_conv_id, row)
-                break
-            else:
-                break
-
-        # Load the new conversation into controller + UI.
-        try:
-            new_rows = dbo.list_messages(self._db, int(new_conv_id), limit=1000000)
-        except Exception:
-            new_rows = []
 
-        # Notify UI: new conversation exists & should be opened.
-        # conversation_started → refresh chats list / badges.
-        try:
-            self.conversation_started.emit(int(new_conv_id))
-        except Exception:
-            pass
-
-        # forked_conversation → MainWindow._open_conversation (draw bubbles + attach controller)
+        # Notify UI once: the handler refreshes the chats list and opens the new conversation
+        # (draw bubbles + attach controller + badges) in one pass.
         try:
             self.forked_conversation.emit(int(new_conv_id))
         except Exception:
@@ -859,12 +1336,16 @@ class ChatController(QObject):
         if role == "user" and user_payload:
             text = user_payload.get("text") or ""
             attachments = self._resolve_attachment_paths(user_payload)
+            # Skip no-op updates: each set relayouts the input / rebuilds the attachments model
             try:
-                self.chat.input.setPlainText(text)
+                if self.chat.input.toPlainText() != text:
+                    self.chat.input.setPlainText(text)
             except Exception:
                 pass
             try:
-                if hasattr(self.chat, "set_pending_attachments"):
+                if hasattr(self.chat, "set_pending_attachments") and not (
+                    self._chat_has_pending and self.chat.get_pending_attachments() == attachments
+                ):
                     self.chat.set_pending_attachments(attachments)
             except Exception:
                 pass
@@ -877,15 +1358,38 @@ class ChatController(QObject):
         if not self._history:
             return
 
-        cutoff = None
-        for i, entry in enumerate(self._history):
+        # Usual case: the cut point is itself an indexed history entry, so it's a dict lookup.
+        pos = self._db_id_to_index.get(message_id)
+        if pos is not None:
+            self._truncate_history_after(pos - 1)
+            return
+
+        # Row ids grow with the conversation, so the entries to drop form a suffix: walk back from
+        # the newest end and stop at the first saved entry older than message_id.
+        drop = 0
+        pending = 0  # unsaved entries seen since the last match; only dropped if a match precedes them
+        for entry in reversed(self._history):
             db_id = entry.db_id
-            if db_id is not None and db_id >= message_id:
-                cutoff = i
+            if db_id is None:
+                pending += 1
+                continue
+            if db_id < message_id:
                 break
-
-        if cutoff is not None:
-            self._history = self._history[:cutoff]
+            drop += pending + 1
+            pending = 0
+
+        if drop:
+            # Also restarts the prompt window if we cut back past its start
+            self._truncate_history_after(self._history_offset + len(self._history) - drop - 1)
+
+    def _truncate_history_after(self, base_index: int) -> None:
+        """Drop every history entry after logical index base_index (kept in place)."""
+        keep = base_index - self._history_offset + 1
+        for _ in range(len(self._history) - keep):
+            self._unindex(self._history.pop())
+        end = self._history_offset + len(self._history)
+        if self._window_start > end:
+            self._window_start = max(self._history_offset, end - self._max_turns)
 
     def _attachment_stub_for_model(self, attachments: list) -> str:
         """
@@ -895,36 +1399,17 @@ class ChatController(QObject):
         if not attachments:
             return ""
 
-        counts = {"image": 0, "audio": 0, "video": 0, "text": 0, "other": 0}
-
+        counts: Counter = Counter()
         for att in attachments:
             if isinstance(att, dict):
                 mime = (att.get("mime") or att.get("mime_type") or "").lower()
-                if mime.startswith("image/"):
-                    counts["image"] += 1
-                elif mime.startswith("audio/"):
-                    counts["audio"] += 1
-                elif mime.startswith("video/"):
-                    counts["video"] += 1
-                elif mime.startswith("text/"):
-                    counts["text"] += 1
-                else:
-                    counts["other"] += 1
+                # A bare top-level type with no "/subtype" counts as other
+                top, sep, _ = mime.partition("/")
+                counts[_MIME_BUCKETS.get(top, "other") if sep else "other"] += 1
             else:
                 counts["other"] += 1
 
-        parts = []
-        if counts["image"]:
-            parts.append(f"{counts['image']} image(s)")
-        if counts["audio"]:
-            parts.append(f"{counts['audio']} audio file(s)")
-        if counts["video"]:
-            parts.append(f"{counts['video']} video file(s)")
-        if counts["text"]:
-            parts.append(f"{counts['text']} text file(s)")
-        if counts["other"]:
-            parts.append(f"{counts['other']} other file(s)")
-
+        parts = [f"{counts[b]} {label}" for b, label in _STUB_LABELS if counts[b]]
         if not parts:
             return ""
 
@@ -959,20 +1444,21 @@ class ChatController(QObject):
         if payload.get("role") != "user":
             return payload
 
-        base_index = payload.get("base_index")
-        if isinstance(base_index, int):
-            if 0 <= base_index < len(self._history):
-                entry = self._history[base_index]
-                if entry.db_id is not None:
-                    # Attach the DB id so callers can use it.
-                    payload["message_id"] = entry.db_id
-                meta = getattr(entry.msg, "metadata", None) or {}
-                try:
-                    atts_meta = meta.get("attachments")
-                    if atts_meta:
-                        payload["attachments_meta"] = atts_meta
-                except Exception:
-                    pass
+        entry = self._history_entry_at(payload.get("base_index"))
+        # Wait only if this entry's insert is still queued/in flight
+        if entry is not None and not self._await_db_id(entry):
+            return None
+        if entry is not None:
+            # The view may hand back its own cached dict; enrich a copy, never the original.
+            payload = dict(payload)
+            if entry.db_id is not None:
+                # Attach the DB id so callers can use it.
+                payload["message_id"] = entry.db_id
+            meta = entry.msg.metadata
+            if isinstance(meta, dict):
+                atts_meta = meta.get("attachments")
+                if atts_meta:
+                    payload["attachments_meta"] = atts_meta
 
         return payload
 
@@ -981,155 +1467,126 @@ class ChatController(QObject):
         Resolve filesystem paths for original attachments, preferring DB-backed metadata.
         """
         paths: list[str] = []
-        try:
-            atts_meta = payload.get("attachments_meta")
-        except Exception:
-            atts_meta = None
-
-        if isinstance(atts_meta, list):
+        atts_meta = payload.get("attachments_meta")
+        if isinstance(atts_meta, list) and self._db is not None:
+            fids: list[int] = []
             for att in atts_meta:
-                if not isinstance(att, dict):
-                    continue
-                fid = att.get("file_id")
-                if fid is None or self._db is None:
+                if not isinstance(att, dict) or att.get("file_id") is None:
                     continue
                 try:
-                    path = dbo.cas_path_for_file(self._db, int(fid))
-                except Exception:
-                    path = None
-                if path:
-                    paths.append(str(path))
-
-        if not paths:
+                    fids.append(int(att["file_id"]))
+                except (TypeError, ValueError):
+                    continue
+            # One batched lookup for every attachment, then keep the payload's order
             try:
-                fallback = payload.get("attachments") or []
+                resolved = dbo.cas_paths_for_files(self._db, fids)
             except Exception:
-                fallback = []
-            for att in fallback:
-                if isinstance(att, str):
-                    paths.append(str(att))
+                resolved = {}
+            paths = [str(resolved[fid]) for fid in fids if fid in resolved]
+
+        if not paths:
+            paths = [att for att in payload.get("attachments") or [] if isinstance(att, str)]
 
         return paths
 
+    def prepare_media(self, attachments: list[str], done) -> None:
+        """
+        Store/thumbnail attachments via process_images() on the media thread, then call
+        done(llm parts, thumbnail paths, attachment metadata, error) back on the UI thread
+        (all empty plus an error message on failure). Sending is blocked in the meantime.
+        Also used by MainWindow for sends from the input box.
+        """
+        options = {
+            "ephemeral": self._media_ephemeral,
+            "session": self._session,
+            "encode": False,  # base64 happens on the broker thread (send_user_with_media)
+        }
+        if self._media_worker is None and not self._start_media_worker():
+            # No second connection available: do it inline, as before.
+            self._on_media_prepared(done, *_process_media(self._db, attachments, options))
+            return
+        # Until the batch is back, a second send would interleave with this one
+        self.chat.set_busy(True)
+        self._media_requested.emit(list(attachments), options, self._db is not None, done)
+
+    def _on_media_prepared(self, done, batch, error) -> None:
+        self.chat.set_busy(False)
+        if error:
+            log.warning("attachment processing failed: %s", error)
+        done(*self._media_result(batch), error)
+
+    @staticmethod
+    def _media_result(batch: Optional[dict]) -> Tuple[list, list[str], List[Dict]]:
+        """(llm parts, thumbnail paths, attachment metadata) for a process_images() batch."""
+        if not batch:
+            return [], [], []
+        thumbs = batch.get("thumbs", ())
+        attachments_meta = [
+            {
+                "file_id": s["file_id"],
+                "sha256": s["sha256"],
+                "mime": s["mime"],
+                "thumb_file_id": t.get("file_id"),
+                "thumb_sha256": t.get("sha256"),
+            }
+            for s, t in zip(batch.get("stored", ()), thumbs)
+        ]
+        return batch["llm_parts"], [t["path"] for t in thumbs], attachments_meta
+
     def _send_with_attachments(self, text: str, attachments: list[str]) -> None:
         if not attachments:
             return
         if text:
             self.chat.append_message("user", text)
         # If vision is unavailable, fall back to text-only send.
-        if not getattr(getattr(self._session, "current", None), "vision", False):
+        if not self._vision_on:
             self._on_user_text(text)
             return
 
-        try:
-            batch = process_images(
-                attachments,
-                ephemeral=(getattr(getattr(self._session, "current", None), "role", "guest") != "user"),
-                db=self._db,
-                session=self._session,
-            )
-            parts = batch["llm_parts"]
-            thumb_paths = [t["path"] for t in batch.get("thumbs", [])]
-            attachments_meta = []
-            for stored, thumb in zip(batch.get("stored", []), batch.get("thumbs", [])):
-                attachments_meta.append({
-                    "file_id": stored["file_id"],
-                    "sha256": stored["sha256"],
-                    "mime": stored["mime"],
-                    "thumb_file_id": thumb.get("file_id"),
-                    "thumb_sha256": thumb.get("sha256"),
-                })
-        except Exception:
-            parts, thumb_paths, attachments_meta = [], [], []
-
-        if not parts:
-            self._on_user_text(text)
-            return
+        def _continue(parts, thumb_paths, attachments_meta, _error):
+            if not parts:
+                self._on_user_text(text)
+                return
+            if thumb_paths:
+                self.chat.draw_thumbs(thumb_paths)
+            self.send_user_with_media(text, parts, attachments_meta or None)
 
-        if thumb_paths:
-            self.chat.draw_thumbs(thumb_paths)
-        self.send_user_with_media(text, parts, attachments_meta or None)
+        self.prepare_media(attachments, _continue)
 
     def _regenerate_text_only(self, text: str) -> None:
         if not text:
             return
         regen_msg = ChatMessage(role="user", content=text)
-        self._history.append(
+        self._append_history(
             HistoryEntry(
                 db_id=None,          # this regen helper user message is not a new DB row
                 msg=regen_msg,
             )
         )
 
-        inj = self.system_injection_if_any()
-
-        def _build_messages(_prompt: str) -> List[ChatMessage]:
-            hist: List[ChatMessage] = []
-
-            # --- persona rule injection (same as _configure_stream) ---
-            if inj is not None:
-                hist.append(inj)
-
-            for entry in self._history[-self._max_turns * 2:]:
-                m = entry.msg
-                has_attachments = bool(m.metadata and m.metadata.get("attachments"))
-                has_text = bool(m.content)
-
-                if has_text:
-                    hist.append(ChatMessage(role=m.role, content=m.content))
-                if has_attachments:
-                    stub = self._attachment_stub_for_model(m.metadata["attachments"])
-                    if stub:
-                        hist.append(ChatMessage(role="user", content=stub))
-            return hist
-
-        def _build_options() -> dict:
-            return {"temperature": 0.7}
+        self._inj = self.system_injection_if_any()
 
-        stream_func = make_stream_func_from_client(
-            self._model_client,
-            model=self._model_name,
-            build_messages=_build_messages,
-            build_options=_build_options,
-        )
-        self._assistant_buf = []
+        stream_func = self._cached_stream_func()
+        self._assistant_buf = io.StringIO()
         self._active_row = self.chat.begin_assistant_stream()
         self.chat.set_streaming(True)
         self._active_ticket = self.broker.submit(stream_func, text)
 
     def _regenerate_with_attachments(self, text: str, attachments: list[str]) -> None:
-        if not getattr(getattr(self._session, "current", None), "vision", False):
+        if not self._vision_on:
             # Fallback: regenerate as text-only.
             self._regenerate_text_only(text)
             return
 
-        try:
-            batch = process_images(
-                attachments,
-                ephemeral=(getattr(getattr(self._session, "current", None), "role", "guest") != "user"),
-                db=self._db,
-                session=self._session,
-            )
-            parts = batch["llm_parts"]
-            attachments_meta = []
-            for stored, thumb in zip(batch.get("stored", []), batch.get("thumbs", [])):
-                attachments_meta.append({
-                    "file_id": stored["file_id"],
-                    "sha256": stored["sha256"],
-                    "mime": stored["mime"],
-                    "thumb_file_id": thumb.get("file_id"),
-                    "thumb_sha256": thumb.get("sha256"),
-                })
-        except Exception:
-            parts, attachments_meta = [], []
-
-        if not parts:
-            # No usable media; fall back to text-only regen
-            self._regenerate_text_only(text)
-            return
+        def _continue(parts, _thumb_paths, attachments_meta, _error):
+            if not parts:
+                # No usable media; fall back to text-only regen
+                self._regenerate_text_only(text)
+                return
+            # Run a media-enabled request without adding new user bubbles to the UI.
+            self.send_user_with_media(text, parts, attachments_meta or None)
 
-        # Run a media-enabled request without adding new user bubbles to the UI.
-        self.send_user_with_media(text, parts, attachments_meta or None)
+        self.prepare_media(attachments, _continue)
 
     def hard_kill(self) -> bool:
         """
@@ -1143,8 +1600,16 @@ class ChatController(QObject):
                 # calls stop_active() on the running worker.
                 self.broker.clear_queue(include_active=True)
 
+            # Persist anything still queued before we go down, then stop the writer thread
+            # (a timeout is logged; quitting the thread below still lets the batch finish)
+            self.flush_pending_writes()
+            self._stop_persist_worker()
+            self._stop_media_worker()
+
             # Defensive: reset controller state
-            self._assistant_buf = []
+            self._flush_timer.stop()
+            self._pending_chunks = []
+            self._assistant_buf = io.StringIO()
             self._active_row = None
             self._active_ticket = -1
 
@@ -1,15 +1,16 @@
 # hamchat/ui/main_window.py
 from __future__ import annotations
-import sys, logging, json
+import sys, logging
 from typing import Optional
 from pathlib import Path
-from PyQt6.QtCore import Qt, QSize, QUrl
+from PyQt6.QtCore import Qt, QDateTime, QSize, QTimer, QUrl
 from PyQt6.QtGui import QDesktopServices
 from PyQt6.QtWidgets import (
     QApplication, QMainWindow, QWidget, QStatusBar, QSplitter, QVBoxLayout, QHBoxLayout,
     QFrame, QLabel, QMessageBox
 )
 
+from hamchat import db_ops as dbo
 from hamchat.paths import settings_dir
 from hamchat.infra.llm.ollama_client import OllamaClient
 from hamchat.infra.llm.openai_client import OpenAIClient
@@ -38,7 +39,6 @@ class EdgeToggleBar(QFrame):
         self.setFixedWidth(EDGE_WIDTH)
         self.setCursor(Qt.CursorShape.PointingHandCursor)
         self.setToolTip(f"Toggle {side} panel")
-        self.setStyleSheet("background:#30343b;")
     def mousePressEvent(self, ev):
         if ev.button() == Qt.MouseButton.LeftButton and callable(self.on_click):
             self.on_click()
@@ -56,20 +56,6 @@ def _vbox(parent):
     w._lay = lay
     return w
 
-def _settings_path():
-    return settings_dir() / "app.json"
-
-def _load_app_cfg() -> dict:
-    try:
-        return json.loads(_settings_path().read_text("utf-8"))
-    except Exception:
-        return {}
-
-def _save_app_cfg(cfg: dict):
-    p = _settings_path()
-    p.parent.mkdir(parents=True, exist_ok=True)
-    p.write_text(json.dumps(cfg, indent=2), encoding="utf-8")
-
 
 class MainWindow(QMainWindow):
     def __init__(
@@ -87,18 +73,30 @@ class MainWindow(QMainWindow):
         self._models_available = None
         self._active_profile_id: Optional[int] = None
         self._active_profile_name: Optional[str] = None
+        # conv_id → title for the signed-in user's chats; filled by _load_user_chats
+        self._conv_titles: dict[int, str] = {}
+        self._test_form: Optional[TestForm] = None
+        self._confirm_box: Optional[QMessageBox] = None
+        self._last_status: Optional[str] = None
+        # Signed-in user as of the last sessionChanged (see _on_session_changed)
+        self._current_uid: Optional[int] = None
+        self._current_role: str = "guest"
 
         self._build_ui()
         self._wire_signals()
 
         self._theme = None
         self._variant = "dark"  # default; may be overridden by saved cfg
+        self._applied_theme_key = None  # (theme identity, variant) last pushed to QSS/QML
         self._init_theme()
 
         # --- Load settings once up front
         app_cfg = Settings(settings_dir() / "app.json")
         self.session = SessionManager(app_cfg, self.runtime_mode, self.server_url)
         self.session.prefsChanged.connect(self._apply_prefs)
+        # Connected before the side panel binds, so its list loaders see the fresh uid/role
+        self.session.sessionChanged.connect(self._on_session_changed)
+        self._on_session_changed(self.session.current)
 
         self.side_panel.bind_session(self.session)
 
@@ -114,12 +112,12 @@ class MainWindow(QMainWindow):
         # Menus now use session getters/setters
         self.menus = Menus(
             menubar=self.menuBar(),
-            get_spell_enabled=lambda: self.session.current.prefs.spellcheck_enabled,
-            get_locale=lambda: self.session.current.prefs.locale,
-            get_locales=lambda: get_available_locales(),
+            get_spell_enabled=self.session.get_spell_enabled,
+            get_locale=self.session.get_locale,
+            get_locales=get_available_locales,
             toggle_spellcheck=self.session.set_spell_enabled,
             set_spell_locale=self.session.set_locale,
-            get_variant=lambda: self.session.current.prefs.theme_variant,
+            get_variant=self.session.get_theme_variant,
             set_variant=self.session.set_theme_variant,
             new_chat=self._new_chat,
             app_exit=self.close,
@@ -149,7 +147,7 @@ class MainWindow(QMainWindow):
         except Exception:
             pass
         try:    # When a conversation is forked, open it just like selecting from side panel
-            self.chat_controller.forked_conversation.connect(self._open_conversation)
+            self.chat_controller.forked_conversation.connect(self._on_conversation_forked)
         except Exception:
             pass
         try:    # Warn if non-vision model and user tried to send attachments
@@ -226,6 +224,12 @@ class MainWindow(QMainWindow):
         self._left_saved_w = 240  # default side panel width
         self._right_saved_w = 260  # default chat panel width
 
+        # Window-drag resizes are coalesced into one split re-apply per frame
+        self._resize_timer = QTimer(self)
+        self._resize_timer.setSingleShot(True)
+        self._resize_timer.setInterval(16)
+        self._resize_timer.timeout.connect(self._apply_split_sizes)
+
         # remember user drags
         self.outer_split.splitterMoved.connect(self._on_outer_split_moved)
         self.inner_split.splitterMoved.connect(self._on_inner_split_moved)
@@ -286,6 +290,13 @@ class MainWindow(QMainWindow):
         self.chat_display.input.set_spell_enabled(self._spell_enabled)
         self.chat_display.input.set_spell_locale(self._spell_locale)
 
+    def _on_session_changed(self, state):
+        uid = getattr(state, "user_id", None)
+        if uid != self._current_uid:
+            self._conv_titles = {}  # titles belong to the previous user's chats
+        self._current_uid = uid
+        self._current_role = getattr(state, "role", "guest")
+
     def _wire_signals(self):
         self.side_panel.sig_open_form.connect(self._open_test_form)
         self.side_panel.ai_profiles_manager.connect(self._open_ai_profiles_manager)
@@ -320,6 +331,12 @@ class MainWindow(QMainWindow):
         self._apply_theme_variant()  # uses self._variant
 
     def _apply_theme_variant(self):
+        # Re-applying the global stylesheet is expensive and prefsChanged also fires for
+        # spellcheck/locale changes; only re-apply when the theme or variant changed.
+        key = (id(self._theme), self._variant)
+        if key == self._applied_theme_key:
+            return
+        self._applied_theme_key = key
         app = QApplication.instance()
         colors = select_variant(self._theme, self._variant)
         apply_theme(app, self, colors)
@@ -375,7 +392,10 @@ class MainWindow(QMainWindow):
 
         if isinstance(self._models_available, int):
             parts.append(f"Models: {self._models_available}")
-        self.statusBar().showMessage(" | ".join(parts))
+        msg = " | ".join(parts)
+        if msg != self._last_status:  # skip the repaint when nothing visible changed
+            self._last_status = msg
+            self.statusBar().showMessage(msg)
 
     def _on_conversation_started(self, conv_id: int):
         """
@@ -383,11 +403,7 @@ class MainWindow(QMainWindow):
         for the current user chat.
         """
         # Refresh 'My Chats' + highlight this conversation
-        self.side_panel.refresh_chats()
-        try:
-            self.side_panel.set_active_chat(conv_id)
-        except Exception:
-            pass
+        self.side_panel.refresh_chats_and_activate(conv_id)
         # Update right-hand panel status + ID badge
         try:
             self.chat_panel.set_conversation_saved(conv_id)
@@ -396,6 +412,16 @@ class MainWindow(QMainWindow):
         except Exception:
             pass
 
+    def _on_conversation_forked(self, conv_id: int):
+        """
+        Called when ChatController forks into a new saved conversation: open it (status and
+        ID badge), then list it in 'My Chats' already highlighted, in one list rebuild.
+        """
+        if self._open_conversation(conv_id, activate=False):
+            self.side_panel.refresh_chats_and_activate(conv_id)
+        else:
+            self.side_panel.refresh_chats()
+
     def toggle_left_panel(self):
         self._left_open = not self._left_open
         # show/hide the actual widget
@@ -430,21 +456,23 @@ class MainWindow(QMainWindow):
         # Only update saved left width when the panel is open.
         if not self._left_open:
             return
-        left_container_w = self.outer_split.sizes()[0]
+        # pos is the handle's x, i.e. the left container's width (no sizes() list round trip)
         # panel width = container minus edge bar
-        self._left_saved_w = max(0, left_container_w - EDGE_WIDTH)
+        self._left_saved_w = max(0, pos - EDGE_WIDTH)
 
     def _on_inner_split_moved(self, pos: int, index: int):
         # Only update saved right width when open.
         if not self._right_open:
             return
-        right_container_w = self.inner_split.sizes()[1]
+        # Right container spans from just past the handle to the splitter's edge
+        right_container_w = self.inner_split.width() - pos - self.inner_split.handleWidth()
         # panel width = container minus edge bar
         self._right_saved_w = max(0, right_container_w - EDGE_WIDTH)
 
     def resizeEvent(self, ev):
         super().resizeEvent(ev)
-        self._apply_split_sizes()
+        # (re)start: a burst of resize events ends up as a single setSizes pass
+        self._resize_timer.start()
 
     # -------- NEW auth handlers --------
     def _open_login_flow(self):
@@ -460,11 +488,10 @@ class MainWindow(QMainWindow):
         self.top_panel.open_with(form)
 
     def _create_admin(self, username: str, password: str):
-        from hamchat.db_ops import create_user
 
         # 1) Write to DB (single source of truth)
         try:
-            uid = create_user(
+            uid = dbo.create_user(
                 self._db,
                 name=username,
                 handle=username.lower(),
@@ -477,24 +504,15 @@ class MainWindow(QMainWindow):
             QMessageBox.critical(self, "Admin setup failed", f"{e}")
             return
 
-        # 2) Reflect in-memory session (emits sessionChanged; updates UI immediately)
+        # 2) Reflect in-memory session (emits sessionChanged; updates UI immediately).
+        # mark_has_admin writes app.json through the one Settings instance loaded at startup.
         self.session.mark_has_admin(True)  # persists via Settings; no restart needed
         self.session.load_user(uid, username, "admin", {})
 
-        # 3) (Optional) Belt & braces: mirror to app.json too
-        try:
-            cfg = _load_app_cfg()
-            cfg.setdefault("auth", {})["has_admin"] = True
-            _save_app_cfg(cfg)
-        except Exception as e:
-            # Non-fatal: DB+session are already correct
-            print(f"Warning: failed to write app.json has_admin flag: {e}")
-
         self.top_panel.close_panel()
 
     def _login_user(self, username: str, password: str):
-        from hamchat.db_ops import authenticate
-        result = authenticate(self._db, username=username, password=password)
+        result = dbo.authenticate(self._db, username=username, password=password)
         if not result:
             # ToDo: Show a QMessageBox here for UX feedback
             return
@@ -507,8 +525,7 @@ class MainWindow(QMainWindow):
 
     def _signup_user(self, username: str, password: str):
         if self.session.signup_requires_approval():
-            from hamchat.db_ops import submit_signup_request
-            rid = submit_signup_request(
+            rid = dbo.submit_signup_request(
                 self._db,
                 name=username,
                 handle=username.lower(),
@@ -524,8 +541,7 @@ class MainWindow(QMainWindow):
             return
 
         # self-serve path (unchanged)
-        from hamchat.db_ops import create_user
-        uid = create_user(
+        uid = dbo.create_user(
             self._db,
             name=username, handle=username.lower(), email=None,
             username=username, password=password, role="user"
@@ -541,7 +557,11 @@ class MainWindow(QMainWindow):
     # ----------------- Settings helpers -----------------
 
     def _open_test_form(self):
-        form = TestForm(); form.sig_close.connect(self.top_panel.close_panel); self.top_panel.open_with(form)
+        # One placeholder form shared by every entry point; built on first use, then reused
+        form = self._test_form
+        if form is None:
+            form = self._test_form = TestForm(); form.sig_close.connect(self.top_panel.close_panel)
+        self.top_panel.open_with(form, keep=True)
 
     def _on_top_closed(self): pass
 
@@ -557,6 +577,8 @@ class MainWindow(QMainWindow):
             form.sig_profile_activated.connect(self._on_profile_activated)
         if hasattr(form, "sig_profiles_changed"):
             form.sig_profiles_changed.connect(self.side_panel.refresh_profiles)
+            # Edited system prompts must not be served from the controller's injection memo
+            form.sig_profiles_changed.connect(self.chat_controller.invalidate_profile_cache)
 
         self.top_panel.open_with(form)
 
@@ -622,10 +644,14 @@ class MainWindow(QMainWindow):
             if not payload:
                 return
 
-            # Pre-fill the input and pending attachments
-            self.chat_display.input.setPlainText(payload.get("text") or "")
+            # Pre-fill the input and pending attachments (skipping no-op updates)
+            text = payload.get("text") or ""
+            if self.chat_display.input.toPlainText() != text:
+                self.chat_display.input.setPlainText(text)
             try:
-                self.chat_display.set_pending_attachments(payload.get("attachments") or [])
+                attachments = payload.get("attachments") or []
+                if self.chat_display.get_pending_attachments() != attachments:
+                    self.chat_display.set_pending_attachments(attachments)
             except Exception:
                 pass
             return
@@ -716,17 +742,18 @@ class MainWindow(QMainWindow):
             # Non-destructive or unknown action → no confirmation
             return True
 
-        resp = QMessageBox.question(
-            self,
-            title,
-            text,
-            QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.No,
-            QMessageBox.StandardButton.No,
-        )
-        return resp == QMessageBox.StandardButton.Yes
+        # One Yes/No box, styled once and reused for every confirmation
+        box = self._confirm_box
+        if box is None:
+            box = self._confirm_box = QMessageBox(self)
+            box.setIcon(QMessageBox.Icon.Question)
+            box.setStandardButtons(QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.No)
+        box.setDefaultButton(QMessageBox.StandardButton.No)
+        box.setWindowTitle(title)
+        box.setText(text)
+        return box.exec() == QMessageBox.StandardButton.Yes
 
     def _rename_conversation(self, conv_id: int, new_title: str):
-        from hamchat import db_ops as dbo
         if not self._db:
             return
         new_title = (new_title or "").strip()
@@ -738,11 +765,8 @@ class MainWindow(QMainWindow):
             log.exception("rename_conversation failed: %s", e)
             QMessageBox.critical(self, "Rename failed", "Could not rename this chat.")
             return
-        self.side_panel.refresh_chats()
-        try:
-            self.side_panel.set_active_chat(conv_id)
-        except Exception:
-            pass
+        self._conv_titles[int(conv_id)] = new_title
+        self.side_panel.refresh_chats_and_activate(conv_id)
 
         # If this conversation is currently open, update ChatPanel title too
         try:
@@ -753,15 +777,17 @@ class MainWindow(QMainWindow):
             pass
 
     def _delete_conversation(self, conv_id: int):
-        from hamchat import db_ops as dbo
         if not self._db:
             return
+        if not self._flush_chat_writes():
+            return
         try:
             dbo.delete_conversation(self._db, conversation_id=int(conv_id))
         except Exception as e:
             log.exception("delete_conversation failed: %s", e)
             QMessageBox.critical(self, "Delete failed", "Could not delete this chat from the database.")
             return
+        self._conv_titles.pop(int(conv_id), None)
 
         # If we just deleted the open conversation, clear the view
         current_id = None
@@ -776,14 +802,9 @@ class MainWindow(QMainWindow):
             self.chat_display.clear_messages()
             self.chat_panel.on_new_chat_started()
 
-        self.side_panel.refresh_chats()
-        try:
-            self.side_panel.set_active_chat(None)
-        except Exception:
-            pass
+        self.side_panel.refresh_chats_and_activate(None)
 
     def _on_attachment_open_requested(self, file_id: int):
-        from hamchat import db_ops as dbo
         if not self._db:
             return
         try:
@@ -801,7 +822,6 @@ class MainWindow(QMainWindow):
             self.statusBar().showMessage("Attachment open failed.", 5000)
 
     def _on_attachment_attach_requested(self, file_id: int):
-        from hamchat import db_ops as dbo
         if not self._db or not hasattr(self, "chat_display"):
             return
         try:
@@ -822,7 +842,6 @@ class MainWindow(QMainWindow):
             self.statusBar().showMessage("Could not attach file to prompt.", 5000)
 
     def _on_attachment_scroll_requested(self, file_id: int):
-        from hamchat import db_ops as dbo
         if not self._db or not hasattr(self, "chat_controller"):
             return
         try:
@@ -832,6 +851,8 @@ class MainWindow(QMainWindow):
         if not conv_id:
             self.statusBar().showMessage("No saved conversation to scroll.", 5000)
             return
+        if not self._flush_chat_writes():
+            return
         try:
             rows = dbo.list_file_occurrences(self._db, conversation_id=int(conv_id), file_id=int(file_id))
         except Exception as e:
@@ -865,7 +886,6 @@ class MainWindow(QMainWindow):
             self.statusBar().showMessage("Could not scroll to message.", 5000)
 
     def _on_profile_activated(self, profile_id: int):
-        from hamchat import db_ops as dbo
         pid = int(profile_id)
         self._active_profile_id = pid
 
@@ -926,13 +946,12 @@ class MainWindow(QMainWindow):
         """
         Loader for SidePanel AI profiles.
         """
-        from hamchat import db_ops as dbo
         if not self._db:
             return ()
-        role = getattr(self.session.current, "role", "guest")
+        role = self._current_role
         if role == "guest":
             return ()
-        uid = getattr(self.session.current, "user_id", None)
+        uid = self._current_uid
         owner = None if role == "admin" else uid
         include_builtin = True
         try:
@@ -959,15 +978,28 @@ class MainWindow(QMainWindow):
         return items
 
 
+    def _flush_chat_writes(self) -> bool:
+        """
+        Commit any message inserts the chat controller still has queued.
+        Returns False (after telling the user) if they did not land in time.
+        """
+        try:
+            if hasattr(self, "chat_controller") and not self.chat_controller.flush_pending_writes():
+                self.statusBar().showMessage("Chat is still being saved; try again in a moment.", 5000)
+                return False
+        except Exception as e:
+            log.exception("flush_pending_writes failed: %s", e)
+        return True
+
     def _load_attachments_for_conversation(self, conv_id: int) -> list[dict]:
         """Fetch attachments for a saved conversation."""
         if not self._db:
             return []
-        role = getattr(self.session.current, "role", "guest")
-        if role != "user":
+        if self._current_role != "user":
+            return []
+        if not self._flush_chat_writes():
             return []
         try:
-            from hamchat import db_ops as dbo
             rows = dbo.list_conversation_files(self._db, conversation_id=int(conv_id))
         except Exception as e:
             log.exception("list_conversation_files failed: %s", e)
@@ -984,14 +1016,13 @@ class MainWindow(QMainWindow):
         Returns a sequence of (conversation_id, label) tuples for the current user.
         Guests/admins → empty list.
         """
-        from hamchat import db_ops as dbo
 
         if not self._db:
             return ()
 
-        uid = getattr(self.session.current, "user_id", None)
-        role = getattr(self.session.current, "role", "guest")
-        if not uid or role != "user":
+        uid = self._current_uid
+        if not uid or self._current_role != "user":
+            self._conv_titles = {}
             return ()
 
         try:
@@ -1005,40 +1036,55 @@ class MainWindow(QMainWindow):
             cid = int(r["id"])
             title = (r.get("title") or "").strip() or f"Chat {cid}"
             items.append((cid, title))
+        # Same query feeds the title lookups (badges / chat panel) until the next refresh
+        self._conv_titles = dict(items)
         return items
 
     def _get_conversation_title(self, conv_id: int) -> str:
-        """Best-effort lookup of a conversation title from the DB."""
-        from hamchat import db_ops as dbo
+        """
+        Best-effort lookup of a conversation title: the list last loaded for the side panel,
+        else a single-row query.
+        """
+        conv_id = int(conv_id)
+        title = self._conv_titles.get(conv_id)
+        if title is not None:
+            return title
         if not self._db:
             return f"Chat {conv_id}"
-        uid = getattr(self.session.current, "user_id", None)
+        uid = self._current_uid
         if not uid:
             return f"Chat {conv_id}"
         try:
-            rows = dbo.list_conversations(self._db, user_id=int(uid), limit=200)
+            title = dbo.get_conversation_title(self._db, conv_id, int(uid))
         except Exception:
             return f"Chat {conv_id}"
-        for r in rows:
-            if int(r["id"]) == int(conv_id):
-                title = (r.get("title") or "").strip()
-                return title or f"Chat {conv_id}"
-        return f"Chat {conv_id}"
+        if title is None:
+            return f"Chat {conv_id}"
+        title = title.strip() or f"Chat {conv_id}"
+        self._conv_titles[conv_id] = title
+        return title
 
-    def _open_conversation(self, conv_id: int):
+    def _open_conversation(self, conv_id: int, *, activate: bool = True) -> bool:
         """
         Load an existing conversation from the DB into the chat display and controller.
+        activate=False leaves highlighting it in 'My Chats' to the caller. Returns True once loaded.
         """
-        from hamchat import db_ops as dbo
         if not self._db:
-            return
+            return False
 
+        # Queued message inserts must land before we read the conversation back
+        if not self._flush_chat_writes():
+            return False
         try:
-            msgs = dbo.list_messages(self._db, conversation_id=int(conv_id), limit=200)
+            # Messages + title in one round trip
+            bundle = dbo.load_conversation_bundle(self._db, int(conv_id), limit=200)
         except Exception as e:
-            log.exception("list_messages failed: %s", e)
+            log.exception("load_conversation_bundle failed: %s", e)
+            bundle = None
+        if bundle is None:
             QMessageBox.critical(self, "Load failed", "Could not load this chat from the database.")
-            return
+            return False
+        msgs = bundle["messages"]
 
         # Restore the latest assistant profile if present
         profile_id = None
@@ -1066,22 +1112,12 @@ class MainWindow(QMainWindow):
         # Clear current UI messages (but don't pop the confirmation dialog here)
         self.chat_display.clear_messages()
 
-        # Fill the display from DB rows
-        for m in msgs:
-            sender = m.get("sender_type", "assistant")
-            text = m.get("content", "") or ""
-            if not text:
-                continue
-
-            if sender == "user":
-                role = "user"
-            elif sender == "system":
-                role = "system"
-            else:
-                # treat tool/assistant as assistant in the UI
-                role = "assistant"
-
-            self.chat_display.append_message(role, text)
+        # Fill the display from DB rows in one model insert (tool/assistant → assistant bubble)
+        self.chat_display.append_messages([
+            (m.get("sender_type") if m.get("sender_type") in ("user", "system") else "assistant",
+             m["content"])
+            for m in msgs if m.get("content")
+        ])
 
         # Tell the controller which conversation + history to use for future prompts
         try:
@@ -1093,7 +1129,6 @@ class MainWindow(QMainWindow):
         if msgs:
             first_ts = msgs[0].get("created")
             try:
-                from PyQt6.QtCore import QDateTime
                 if isinstance(first_ts, (int, float)):
                     dt = QDateTime.fromSecsSinceEpoch(int(first_ts))
                     self.chat_panel.set_created_at(dt)
@@ -1103,14 +1138,17 @@ class MainWindow(QMainWindow):
         # This is a persisted conversation
         try:
             self.chat_panel.set_conversation_saved(conv_id)
-            title = self._get_conversation_title(conv_id)
+            title = (bundle["title"] or "").strip() or f"Chat {int(conv_id)}"
+            self._conv_titles[int(conv_id)] = title
             self.chat_panel.set_conversation_title(title)
         except Exception:
             pass
-        try:
-            self.side_panel.set_active_chat(conv_id)
-        except Exception:
-            pass
+        if activate:
+            try:
+                self.side_panel.set_active_chat(conv_id)
+            except Exception:
+                pass
+        return True
 
     def _new_chat(self, system_call: bool=False) -> bool:
         """
@@ -1188,34 +1226,24 @@ class MainWindow(QMainWindow):
                 pass
             return
 
-        # Vision path: process + send with media
-        try:
-            from hamchat.media_helper import process_images
-            batch = process_images(attachments, ephemeral=(self.session.current.role != "user"), db=self._db,
-                                   session=self.session)
-            parts = batch["llm_parts"]
-            thumb_paths = [t["path"] for t in batch.get("thumbs", [])]
-            attachments_meta = []
-            for stored, thumb in zip(batch.get("stored", []), batch.get("thumbs", [])):
-                attachments_meta.append({
-                    "file_id": stored["file_id"],
-                    "sha256": stored["sha256"],
-                    "mime": stored["mime"],
-                    "thumb_file_id": thumb.get("file_id"),
-                    "thumb_sha256": thumb.get("sha256"),
-                })
-        except Exception as e:
-            self.statusBar().showMessage(f"Attachment processing failed: {e}", 6000)
-            # As a last resort, send text so the user isn't blocked
-            self.chat_display.sig_send_text.emit(text)
-            return
+        # Vision path: hashing/thumbnailing/CAS writes run on the controller's media thread;
+        # the send continues here on the UI thread once the batch is ready.
+        self.statusBar().showMessage("Processing attachments…")
 
-        if parts:
-            if thumb_paths:
-                self.chat_display.draw_thumbs(thumb_paths)
-            self.chat_controller.send_user_with_media(text, parts, attachments_meta or None)
-        else:
-            self.chat_display.sig_send_text.emit(text)
+        def _on_ready(parts, thumb_paths, attachments_meta, error):
+            self._last_status = None  # the progress note replaced it; force a repaint
+            self._refresh_status()
+            if parts:
+                if thumb_paths:
+                    self.chat_display.draw_thumbs(thumb_paths)
+                self.chat_controller.send_user_with_media(text, parts, attachments_meta or None)
+            else:
+                reason = f": {error}" if error else ""
+                self.statusBar().showMessage(f"Attachment processing failed{reason}; sending text only.", 6000)
+                # As a last resort, send text so the user isn't blocked
+                self.chat_display.sig_send_text.emit(text)
+
+        self.chat_controller.prepare_media(list(attachments), _on_ready)
 
     def closeEvent(self, ev):
         ok = True
@@ -105,6 +105,15 @@ class MessageListModel(QAbstractListModel):
         self._items.append(msg)
         self.endInsertRows()
 
+    def extend(self, msgs: List[Msg]):
+        """Append many messages with a single rowsInserted (one delegate pass in the view)."""
+        if not msgs:
+            return
+        first = len(self._items)
+        self.beginInsertRows(QModelIndex(), first, first + len(msgs) - 1)
+        self._items.extend(msgs)
+        self.endInsertRows()
+
     def append_and_index(self, msg: Msg) -> int:
         row = len(self._items)
         self.beginInsertRows(QModelIndex(), row, row)
@@ -177,6 +186,7 @@ class ChatDisplay(QWidget):
         self._qml_tokens = {}
         self._model = MessageListModel([])
         self._streaming = False
+        self._busy = False  # set while a send is still being prepared (see set_busy)
         self._last_action = 0.0
         self._attachments = _AttachModel(self)
 
@@ -213,11 +223,17 @@ class ChatDisplay(QWidget):
     # --- public API for controller ---
     def set_streaming(self, on: bool) -> None:
         self._streaming = bool(on)
-        self.input.setReadOnly(self._streaming)
+        self.input.setReadOnly(self._streaming or self._busy)
         self.send.setText("Stop" if self._streaming else "Send")
         self.send.setProperty("accent", not self._streaming)  # subtle visual cue
         self.send.style().unpolish(self.send); self.send.style().polish(self.send)
 
+    def set_busy(self, on: bool) -> None:
+        """Block new sends (e.g. while attachments are prepared) without entering the Stop state."""
+        self._busy = bool(on)
+        self.input.setReadOnly(self._busy or self._streaming)
+        self.send.setEnabled(not self._busy)
+
     # called by MainWindow after theme applied
     def set_qml_tokens(self, tokens: dict) -> None:
         self._qml_tokens = tokens or {}
@@ -227,6 +243,11 @@ class ChatDisplay(QWidget):
         self._call_qml("ensureAtEnd")
         self._model.append(Msg(role, text))
 
+    def append_messages(self, items: List[tuple[str, str]]) -> None:
+        """Bulk append_message for (role, text) pairs, e.g. when loading a saved conversation."""
+        self._call_qml("ensureAtEnd")
+        self._model.extend([Msg(role, text) for role, text in items])
+
     # ------- internals -------
     def _on_send_clicked(self):
         now = time.monotonic()
@@ -239,8 +260,8 @@ class ChatDisplay(QWidget):
         self._submit_text(self.input.toPlainText().strip())
 
     def _submit_text(self, text: str):
-        # Don't allow submitting while streaming a response
-        if self._streaming:
+        # Don't allow submitting while streaming a response or preparing the previous send
+        if self._streaming or self._busy:
             return
 
         # Take a snapshot of attachments *before* we decide to bail
@@ -410,6 +410,11 @@ class SidePanel(QWidget):
     def refresh_chats(self):
         self._fill_list(self._chat_list, self._list_chats or _empty_loader)
 
+    def refresh_chats_and_activate(self, conv_id: Optional[int]):
+        """refresh_chats + set_active_chat in one list rebuild (the fill marks the active chat)."""
+        self._active_chat_id = conv_id
+        self.refresh_chats()
+
     def refresh_users(self):
         self._fill_list(self._user_list, self._list_users or _empty_loader)
 
@@ -417,6 +422,14 @@ class SidePanel(QWidget):
     def _fill_list(self, widget: Optional[QListWidget], loader: Loader):
         if widget is None:
             return
+        # One repaint for the whole rebuild instead of one per item
+        widget.setUpdatesEnabled(False)
+        try:
+            self._fill_items(widget, loader)
+        finally:
+            widget.setUpdatesEnabled(True)
+
+    def _fill_items(self, widget: QListWidget, loader: Loader):
         widget.clear()
         try:
             items = list(loader() or ())
@@ -453,8 +466,8 @@ class SidePanel(QWidget):
                 selected_item = it
             it.setText(display)
             widget.addItem(it)
-            if selected_item is not None:
-                widget.setCurrentItem(selected_item)
+        if selected_item is not None:
+            widget.setCurrentItem(selected_item)
 
     def set_active_profile(self, profile_id: Optional[int]) -> None:
         """Highlight the active AI profile."""
@@ -18,9 +18,16 @@ class TopPanel(QFrame):
         self._host = QFrame(self)
         lay = QVBoxLayout(self); lay.setContentsMargins(0,0,0,0); lay.addWidget(self._host)
         self._host_lay = QVBoxLayout(self._host); self._host_lay.setContentsMargins(12,12,12,12); self._host_lay.setSpacing(8)
+        self._kept: set[QWidget] = set()  # reusable forms: hidden on clear, owned (and deleted) by the panel
 
-    def open_with(self, w: QWidget):
-        self.clear(); self._host_lay.addWidget(w); self._set_expanded(True)
+    def open_with(self, w: QWidget, keep: bool = False):
+        """Show w in the panel; keep=True lets the caller reopen the same widget later."""
+        self.clear()
+        if keep and w not in self._kept:
+            self._kept.add(w)
+            # Forget it once Qt deletes it (with the panel, or by its owner)
+            w.destroyed.connect(lambda _=None, w=w: self._kept.discard(w))
+        self._host_lay.addWidget(w); w.show(); self._set_expanded(True)
 
     def close_panel(self):
         self._set_expanded(False); self.clear(); self.sig_closed.emit()
@@ -28,7 +35,12 @@ class TopPanel(QFrame):
     def clear(self):
         while self._host_lay.count():
             it = self._host_lay.takeAt(0); w = it.widget()
-            if w: w.setParent(None); w.deleteLater()
+            if not w: continue
+            if w in self._kept:
+                # Park it under the panel rather than orphaning it, so it is freed with the panel
+                w.hide(); w.setParent(self)
+            else:
+                w.setParent(None); w.deleteLater()
 
     def _set_expanded(self, on: bool):
         if on == self._expanded: return
@@ -0,0 +1,29 @@
+# tests/conftest.py
+from __future__ import annotations
+import os
+import sys
+from pathlib import Path
+
+import pytest
+
+# Headless Qt; the repo root goes on sys.path by absolute path because fixtures chdir away.
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    """Fresh open-mode database; data/ and settings/ live under a throwaway working dir."""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv("HAMCHAT_DB_MODE", "open")
+    from hamchat import db_ops as dbo
+    conn, _mode = dbo.init_and_open()
+    yield conn
+    conn.close()
+
+
+@pytest.fixture
+def user_id(db) -> int:
+    from hamchat import db_ops as dbo
+    return dbo.create_user(db, name="Test", handle="test", email=None,
+                           username="test", password="pw")
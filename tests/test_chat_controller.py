@@ -0,0 +1,218 @@
+# tests/test_chat_controller.py
+from __future__ import annotations
+
+from types import SimpleNamespace
+
+import pytest
+from PIL import Image
+from PyQt6.QtCore import QCoreApplication, QObject, pyqtSignal
+
+from hamchat import db_ops as dbo
+from hamchat.infra.llm.base import ChatMessage
+from hamchat.ui import chat_controller as cc
+
+
+class FakeChat(QObject):
+    """The slice of ChatDisplay the controller talks to, minus QML."""
+
+    sig_send_text = pyqtSignal(str)
+    sig_stop_requested = pyqtSignal()
+
+    def __init__(self):
+        super().__init__()
+        self.streaming = False
+        self.busy = False
+
+    def begin_assistant_stream(self):
+        return 0
+
+    def set_streaming(self, on):
+        self.streaming = on
+
+    def set_busy(self, on):
+        self.busy = on
+
+    def append_message(self, role, text):
+        pass
+
+    def stream_chunk(self, row, text):
+        pass
+
+    def end_assistant_stream(self, row):
+        pass
+
+
+class FakeClient:
+    """Records the messages of every stream_chat call and streams nothing back."""
+
+    def __init__(self):
+        self.calls = []
+
+    def stream_chat(self, *, model, messages, options):
+        self.calls.append(messages)
+        return iter(())
+
+
+class FakeSession(QObject):
+    """A signed-in user as far as the controller's session cache is concerned."""
+
+    sessionChanged = pyqtSignal(object)
+
+    def __init__(self, user_id):
+        super().__init__()
+        self.current = SimpleNamespace(user_id=user_id, role="user", vision=False)
+
+
+@pytest.fixture(scope="session")
+def qapp():
+    return QCoreApplication.instance() or QCoreApplication([])
+
+
+def _make_controller(db=None, session=None):
+    client = FakeClient()
+    ctrl = cc.ChatController(FakeChat(), client, model_name="test-model", db=db, session=session)
+    submitted = []
+    # Run stream funcs on demand instead of on the broker thread
+    ctrl.broker.submit = lambda func, prompt: submitted.append((func, prompt)) or len(submitted)
+    ctrl.client, ctrl.submitted = client, submitted
+    return ctrl
+
+
+@pytest.fixture
+def controller(qapp):
+    ctrl = _make_controller()
+    yield ctrl
+    ctrl.hard_kill()
+
+
+@pytest.fixture
+def saving_controller(qapp, db, user_id):
+    ctrl = _make_controller(db, FakeSession(user_id))
+    yield ctrl
+    ctrl.hard_kill()
+
+
+def _rows(db, conv_id):
+    return [(m["sender_type"], m["content"]) for m in dbo.list_messages(db, conv_id)]
+
+
+def _turn(ctrl, prompt, reply):
+    """One user turn streamed to completion (the broker is bypassed)."""
+    ctrl._on_user_text(prompt)
+    ticket = ctrl._active_ticket
+    ctrl._on_job_token(ticket, reply)
+    ctrl._on_job_finished(ticket, "ok")
+
+
+def test_media_worker_commits_before_next_writer(db, user_id, tmp_path):
+    # The media thread stores attachments through its own connection; if those rows stayed
+    # uncommitted, that connection would hold the write lock and the next writer would fail.
+    img = tmp_path / "pic.png"
+    Image.new("RGB", (64, 48), "red").save(img)
+    worker = cc._MediaWorker(dbo.open_connection(check_same_thread=False))
+    got = []
+    worker.prepared.connect(lambda done, batch, error: got.append((batch, error)))
+    try:
+        worker.prepare([str(img)], {"ephemeral": False, "session": None, "encode": False}, True, None)
+        batch, error = got[0]
+        assert error is None
+        file_id = batch["stored"][0]["file_id"]
+
+        db.execute("PRAGMA busy_timeout=0")  # fail at once instead of waiting 5 s on a lock
+        conv_id = dbo.create_conversation(db, user_id=user_id, title="after attachment")
+        assert conv_id
+        # The files row is visible (committed) to the GUI connection
+        assert dbo.cas_path_for_file(db, file_id) is not None
+    finally:
+        worker.close()
+
+
+def test_media_send_uses_raw_history(controller, tmp_path):
+    # Earlier turns reach a vision request as recorded, not as text-only attachment stubs
+    earlier = ChatMessage(role="user", content="first picture",
+                          metadata={"attachments": [{"file_id": 1, "mime": "image/png"}]})
+    controller._append_history(cc.HistoryEntry(db_id=None, msg=earlier))
+    controller._append_history(cc.HistoryEntry(db_id=None, msg=ChatMessage(role="assistant", content="nice")))
+    img = tmp_path / "pic.png"
+    Image.new("RGB", (8, 8), "blue").save(img)
+
+    controller.send_user_with_media("and this one", [{"type": "image", "media_type": "image/png",
+                                                      "path": str(img)}])
+    func, prompt = controller.submitted[-1]
+    list(func(prompt, stop_fn=lambda: False))
+
+    sent = controller.client.calls[-1]
+    assert sent[0] is earlier
+    assert [m.content for m in sent] == ["first picture", "nice", "and this one"]
+    assert sent[-1].parts[0]["data_base64"]
+
+
+def test_text_send_uses_stubbed_history(controller):
+    earlier = ChatMessage(role="user", content="first picture",
+                          metadata={"attachments": [{"file_id": 1, "mime": "image/png"}]})
+    controller._append_history(cc.HistoryEntry(db_id=None, msg=earlier))
+    hist = controller._build_history()
+    assert hist[0] is not earlier and hist[0].content == "first picture"
+    assert len(hist) == 2  # text plus the attachment stub
+
+
+def test_turn_is_written_behind_in_one_batch(saving_controller, db):
+    ctrl = saving_controller
+    ctrl._on_user_text("hi")
+    conv_id = ctrl.current_conversation_id()
+    assert conv_id is not None
+    # The user row waits for its reply instead of arming the write timer
+    assert ctrl._pending_writes and not ctrl._write_timer.isActive()
+
+    ticket = ctrl._active_ticket
+    ctrl._on_job_token(ticket, "hello")
+    ctrl._on_job_finished(ticket, "ok")
+    assert len(ctrl._pending_writes) == 2 and ctrl._write_timer.isActive()
+    assert _rows(db, conv_id) == []
+
+    assert ctrl.flush_pending_writes()
+    assert ctrl._persist_worker is not None  # committed on the writer thread, started lazily
+    assert _rows(db, conv_id) == [("user", "hi"), ("assistant", "hello")]
+    ids = [m["id"] for m in dbo.list_messages(db, conv_id)]
+    assert [e.db_id for e in ctrl._history] == ids
+    assert [ctrl.base_index_for_message_id(i) for i in ids] == [0, 1]
+
+
+def test_stopped_turn_still_writes_user_row(saving_controller, db):
+    ctrl = saving_controller
+    ctrl._on_user_text("hi")
+    ctrl._on_job_error(ctrl._active_ticket, "boom")
+    assert ctrl._write_timer.isActive()
+    assert ctrl.flush_pending_writes()
+    assert _rows(db, ctrl.current_conversation_id()) == [("user", "hi")]
+
+
+def test_truncate_commits_before_replayed_rows(saving_controller, db):
+    ctrl = saving_controller
+    _turn(ctrl, "one", "reply one")
+    _turn(ctrl, "two", "reply two")
+    assert ctrl.flush_pending_writes()
+    conv_id = ctrl.current_conversation_id()
+    second_user = dbo.list_messages(db, conv_id)[2]["id"]
+
+    # As resend_message does: deferred truncate, then the replayed turn, all in one batch
+    ctrl._queue_truncate(second_user, defer=True)
+    ctrl._truncate_history_from_message_id(second_user)
+    _turn(ctrl, "two again", "reply again")
+    assert ctrl.flush_pending_writes()
+    # The delete ran first, so it didn't take the (higher-id) replayed rows with it
+    assert _rows(db, conv_id) == [("user", "one"), ("assistant", "reply one"),
+                                  ("user", "two again"), ("assistant", "reply again")]
+
+
+def test_write_batch_is_all_or_nothing(db, user_id):
+    conv_id = dbo.create_conversation(db, user_id=user_id, title="t")
+    entry = cc.HistoryEntry(db_id=None, msg=ChatMessage(role="user", content="x"))
+
+    def boom(conn, *, commit, **fields):
+        raise RuntimeError("write failed")
+
+    fields = dict(conversation_id=conv_id, sender_type="user", sender_id=user_id, content="x")
+    ids = cc._write_batch(db, [(dbo.add_message, entry, fields), (boom, None, {})])
+    assert ids == [(entry, None)]
+    assert _rows(db, conv_id) == []
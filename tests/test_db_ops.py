@@ -0,0 +1,107 @@
+# tests/test_db_ops.py
+from __future__ import annotations
+import hashlib
+
+import pytest
+
+from hamchat import db_ops as dbo
+
+
+def _store(db, tmp_path, payload: bytes) -> int:
+    src = tmp_path / f"{hashlib.sha1(payload).hexdigest()}.bin"
+    src.write_bytes(payload)
+    fid = dbo.cas_put(db, sha256=hashlib.sha256(payload).hexdigest(), mime="image/png", src_path=str(src))
+    db.commit()
+    return fid
+
+
+def _ref_count(db, file_id: int) -> int:
+    return db.execute("SELECT ref_count FROM files WHERE id=?", (file_id,)).fetchone()[0]
+
+
+@pytest.fixture
+def conversation(db, user_id, tmp_path):
+    """Four-message conversation whose second message carries an attachment + thumb."""
+    conv = dbo.create_conversation(db, user_id=user_id, title="source")
+    att, thumb = _store(db, tmp_path, b"image"), _store(db, tmp_path, b"thumb")
+    meta = {"attachments": [{"file_id": att, "thumb_file_id": thumb}]}
+    ids = [
+        dbo.add_message(db, conv, "user", user_id, "hello"),
+        dbo.add_message(db, conv, "user", user_id, "look", meta),
+        dbo.add_message(db, conv, "assistant", None, "nice"),
+        dbo.add_message(db, conv, "user", user_id, "bye"),
+    ]
+    return conv, ids, att, thumb
+
+
+@pytest.mark.parametrize("include_pivot, expected", [(False, ["hello", "look"]),
+                                                     (True, ["hello", "look", "nice"])])
+def test_clone_messages_bulk_up_to_pivot(db, user_id, conversation, include_pivot, expected):
+    conv, ids, _att, _thumb = conversation
+    dst = dbo.create_conversation(db, user_id=user_id, title="fork")
+    n = dbo.clone_messages_bulk(db, conv, dst, ids[2], include_pivot)
+    assert n == len(expected)
+    assert [m["content"] for m in dbo.list_messages(db, dst)] == expected
+    # The source is left alone
+    assert len(dbo.list_messages(db, conv)) == 4
+
+
+def test_clone_messages_bulk_links_files_and_counts_refs(db, user_id, conversation):
+    conv, ids, att, thumb = conversation
+    assert (_ref_count(db, att), _ref_count(db, thumb)) == (1, 1)
+    dst = dbo.create_conversation(db, user_id=user_id, title="fork")
+    dbo.clone_messages_bulk(db, conv, dst, ids[3])
+
+    copied = dbo.list_messages(db, dst)
+    links = db.execute(
+        "SELECT message_id, file_id, role FROM message_files WHERE message_id IN (?, ?, ?) ORDER BY role",
+        [m["id"] for m in copied],
+    ).fetchall()
+    # Paired by rank: the links land on the copy of "look", not on a neighbour
+    assert links == [(copied[1]["id"], att, "attachment"), (copied[1]["id"], thumb, "thumb")]
+    assert (_ref_count(db, att), _ref_count(db, thumb)) == (2, 2)
+
+
+def test_clone_messages_bulk_into_non_empty_target(db, user_id, conversation):
+    conv, ids, att, _thumb = conversation
+    dst = dbo.create_conversation(db, user_id=user_id, title="fork")
+    dbo.add_message(db, dst, "user", user_id, "already here")
+    dbo.clone_messages_bulk(db, conv, dst, ids[1], include_pivot=True)
+    copied = dbo.list_messages(db, dst)
+    assert [m["content"] for m in copied] == ["already here", "hello", "look"]
+    linked = db.execute("SELECT message_id FROM message_files WHERE file_id=? ORDER BY message_id",
+                        (att,)).fetchall()
+    assert linked == [(ids[1],), (copied[2]["id"],)]
+
+
+def test_load_conversation_bundle(db, user_id, conversation):
+    conv, ids, att, _thumb = conversation
+    bundle = dbo.load_conversation_bundle(db, conv)
+    assert bundle["title"] == "source"
+    assert [m["id"] for m in bundle["messages"]] == ids
+    assert bundle["messages"][1]["metadata"]["attachments"][0]["file_id"] == att
+    assert bundle["messages"] == dbo.list_messages(db, conv)
+    assert [m["id"] for m in dbo.load_conversation_bundle(db, conv, limit=2)["messages"]] == ids[:2]
+
+
+def test_load_conversation_bundle_empty_and_missing(db, user_id):
+    conv = dbo.create_conversation(db, user_id=user_id, title="empty")
+    bundle = dbo.load_conversation_bundle(db, conv)
+    assert bundle["title"] == "empty" and bundle["messages"] == []
+    assert dbo.load_conversation_bundle(db, conv + 1000) is None
+
+
+def test_cas_paths_for_files_across_chunks(db, tmp_path, monkeypatch):
+    monkeypatch.setattr(dbo, "_IN_CHUNK", 2)
+    fids = [_store(db, tmp_path, f"blob {i}".encode()) for i in range(5)]
+    paths = dbo.cas_paths_for_files(db, fids + [fids[0], 99999])
+    assert set(paths) == set(fids)
+    for fid in fids:
+        assert paths[fid] == dbo.cas_path_for_file(db, fid)
+    assert dbo.cas_paths_for_files(db, []) == {}
+
+
+def test_cas_paths_for_files_skips_missing_blobs(db, tmp_path):
+    keep, gone = _store(db, tmp_path, b"keep"), _store(db, tmp_path, b"gone")
+    dbo.cas_path_for_file(db, gone).unlink()
+    assert set(dbo.cas_paths_for_files(db, [keep, gone])) == {keep}
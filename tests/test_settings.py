@@ -0,0 +1,63 @@
+# tests/test_settings.py
+from __future__ import annotations
+import json
+
+from hamchat import settings
+
+
+def test_save_settings_writes_stdlib_json(tmp_path):
+    path = tmp_path / "app.json"
+    data = {"b": {"é": 1}, "a": [1, 2]}
+    settings.save_settings(path, data)
+    assert path.read_bytes() == json.dumps(data, indent=2, sort_keys=True).encode("utf-8")
+
+
+def test_save_settings_skips_unchanged_write(tmp_path):
+    path = tmp_path / "app.json"
+    settings.save_settings(path, {"a": 1})
+    written = path.stat().st_mtime_ns
+    settings.save_settings(path, {"a": 1})
+    assert path.stat().st_mtime_ns == written
+    settings.save_settings(path, {"a": 2})
+    assert json.loads(path.read_text(encoding="utf-8")) == {"a": 2}
+    assert not (tmp_path / "app.json.tmp").exists()
+
+
+def test_load_settings_fills_defaults_without_sharing_them(tmp_path):
+    path = tmp_path / "app.json"
+    first = settings.load_settings(path)  # missing file: defaults are written and returned
+    assert first == settings.DEFAULT_SETTINGS
+    first["logging"]["level"] = "DEBUG"
+    assert settings.DEFAULT_SETTINGS["logging"]["level"] == "INFO"
+    assert settings.load_settings(path)["logging"]["level"] == "INFO"
+
+    path.write_text(json.dumps({"ui": {"theme": "dark"}}), encoding="utf-8")
+    cfg = settings.load_settings(path)
+    assert cfg["ui"] == {"theme": "dark"}
+    assert cfg["auth"] == settings.DEFAULT_SETTINGS["auth"]
+    cfg["auth"]["has_admin"] = True
+    assert settings.DEFAULT_SETTINGS["auth"]["has_admin"] is None
+
+
+def test_load_settings_caches_on_mtime(tmp_path, monkeypatch):
+    path = tmp_path / "app.json"
+    settings.save_settings(path, {"ui": {"theme": "dark"}})
+    parses = []
+    real_load = json.load
+    monkeypatch.setattr(settings.json, "load", lambda f: parses.append(1) or real_load(f))
+
+    first = settings.load_settings(path)
+    first["ui"]["theme"] = "mutated"  # callers get copies; the cached dict stays intact
+    second = settings.load_settings(path)
+    assert len(parses) == 1
+    assert second["ui"]["theme"] == "dark"
+
+    # Edited behind our back: a new (mtime, size) stamp forces a re-read
+    path.write_text(json.dumps({"ui": {"theme": "light!"}}), encoding="utf-8")
+    assert settings.load_settings(path)["ui"]["theme"] == "light!"
+    assert len(parses) == 2
+
+    # save_settings drops the entry itself, even if the stamp happened to match
+    settings.save_settings(path, {"ui": {"theme": "blue!!"}})
+    assert settings.load_settings(path)["ui"]["theme"] == "blue!!"
+    assert len(parses) == 3